@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import logging
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from datetime import date, timedelta
+
+from flask import Flask, Response, request, redirect, abort
+from werkzeug.serving import make_server
+
+SESSION_COOKIE = "MAREONSESSION"
+MANDANT_COOKIE = "MAREONMANDANT"
+INVOICE_NUMBER_BASE = 1000000
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><title>Mareon Login</title></head>
+<body>
+<form method="post" action="/login">
+  <input type="text" id="modlgn_username" name="username">
+  <input type="password" id="modlgn_passwd" name="passwd">
+  <input type="submit" name="Submit" value="Anmelden">
+</form>
+</body></html>
+"""
+
+INVOICES_PAGE = """<!DOCTYPE html>
+<html><head><title>Rechnungen</title>
+<style>
+  .ui-selectonemenu-panel {{ display: none; }}
+  .ui-selectonemenu-panel.open {{ display: block; }}
+</style>
+</head>
+<body>
+<div class="ui-selectonemenu" id="mandant">
+  <label class="ui-selectonemenu-label">{current_mandant}</label>
+  <div class="ui-selectonemenu-trigger" onclick="document.getElementById('mandant-panel').classList.add('open')">&#9660;</div>
+</div>
+<div class="ui-selectonemenu-panel" id="mandant-panel">
+  <ul>{mandant_items}</ul>
+</div>
+<table>
+  <thead><tr><th>Nr</th><th>Datum</th><th>Betrag</th><th></th></tr></thead>
+  <tbody>{rows}</tbody>
+</table>
+<div class="ui-paginator">{next_link}</div>
+<script>
+function selectMandant(item, value) {{
+  document.cookie = "{mandant_cookie}=" + value + "; path=/";
+  document.getElementById('mandant-panel').classList.remove('open');
+  document.querySelector('.ui-selectonemenu-label').textContent = item.textContent;
+}}
+</script>
+</body></html>
+"""
+
+
+def invoice_pdf(invoice_nr, size):
+    header = f"%PDF-1.4\n% Benchmark invoice {invoice_nr}\n".encode('ascii')
+    return header + b"0" * max(0, size - len(header)) + b"\n%%EOF\n"
+
+
+def create_portal(mandants, invoices_per_mandant, page_size, pdf_size, browser_downloads):
+    app = Flask("fake_mareon")
+    today = date.today()
+
+    def invoice_number(mandant, index):
+        return f"S-{INVOICE_NUMBER_BASE * (mandant + 1) + invoices_per_mandant - index}"
+
+    def logged_in():
+        return request.cookies.get(SESSION_COOKIE) == "ok"
+
+    def current_mandant():
+        value = request.cookies.get(MANDANT_COOKIE, type=int)
+        return value if value is not None and 0 <= value < len(mandants) else 0
+
+    @app.route('/')
+    def home():
+        return redirect('/portal/rechnungen' if logged_in() else '/login')
+
+    @app.route('/login', methods=['GET', 'POST'])
+    def login():
+        if request.method == 'GET':
+            return LOGIN_PAGE
+        if not request.form.get('username') or not request.form.get('passwd'):
+            return LOGIN_PAGE
+        response = redirect('/portal/rechnungen')
+        response.set_cookie(SESSION_COOKIE, "ok")
+        return response
+
+    @app.route('/portal/rechnungen')
+    def invoices():
+        if not logged_in():
+            return redirect('/login')
+
+        mandant = current_mandant()
+        page = max(1, request.args.get('page', 1, type=int))
+        start = (page - 1) * page_size
+        end = min(start + page_size, invoices_per_mandant)
+
+        rows = []
+        for index in range(start, end):
+            invoice_nr = invoice_number(mandant, index)
+            url = f"/portal/rechnungen/download/{invoice_nr}.pdf"
+            if browser_downloads:
+                link = f'<a title="Rechnungsdruck" href="#" onclick="window.location=\'{url}\'; return false;">PDF</a>'
+            else:
+                link = f'<a title="Rechnungsdruck" href="{url}">PDF</a>'
+            invoice_date = (today - timedelta(days=index)).strftime("%d.%m.%Y")
+            amount = f"{1000 + index:,}.00".replace(",", "X").replace(".", ",").replace("X", ".")
+            rows.append(
+                f"<tr><td>{invoice_nr}</td><td>{invoice_date}</td><td>{amount} &euro;</td><td>{link}</td></tr>"
+            )
+
+        if end < invoices_per_mandant:
+            next_link = f'<a class="ui-paginator-next" href="/portal/rechnungen?page={page + 1}">&gt;</a>'
+        else:
+            next_link = '<a class="ui-paginator-next ui-state-disabled">&gt;</a>'
+
+        mandant_items = "".join(
+            f'<li class="ui-selectonemenu-item" onclick="selectMandant(this, {i})">{name}</li>'
+            for i, name in enumerate(mandants)
+        )
+        return INVOICES_PAGE.format(
+            current_mandant=mandants[mandant],
+            mandant_items=mandant_items,
+            rows="".join(rows),
+            next_link=next_link,
+            mandant_cookie=MANDANT_COOKIE,
+        )
+
+    @app.route('/portal/rechnungen/download/<invoice_nr>.pdf')
+    def download(invoice_nr):
+        if not logged_in():
+            abort(403)
+        return Response(
+            invoice_pdf(invoice_nr, pdf_size),
+            mimetype='application/pdf',
+            headers={'Content-Disposition': f'attachment; filename="{invoice_nr}.pdf"'}
+        )
+
+    return app
+
+
+def create_butler_stub(latency, error_rate, stats):
+    app = Flask("fake_butler")
+    lock = threading.Lock()
+
+    @app.route('/v1/documents', methods=['POST'])
+    def documents():
+        if latency:
+            time.sleep(latency)
+        with lock:
+            stats['requests'] += 1
+            if random.random() < error_rate:
+                stats['errors'] += 1
+                return {'error': 'temporarily unavailable'}, 503
+            stats['accepted'] += 1
+        return {'status': 'created'}, 201
+
+    return app
+
+
+def serve(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the scraper against a local fake Mareon portal")
+    parser.add_argument("--accounts", type=int, default=1, help="accounts (one mandant each)")
+    parser.add_argument("--invoices", type=int, default=100, help="invoices per account")
+    parser.add_argument("--page-size", type=int, default=25, help="invoice rows per page")
+    parser.add_argument("--pdf-kb", type=int, default=50, help="size of each invoice PDF in KB")
+    parser.add_argument("--workers", type=int, default=None, help="scraper workers (default: SCRAPER_MAX_WORKERS)")
+    parser.add_argument("--browser-downloads", action="store_true", help="force downloads through Chrome instead of HTTP")
+    parser.add_argument("--lean", action="store_true", help="use the lean browser profile (BROWSER_LEAN=1)")
+    parser.add_argument("--local-save", action="store_true", help="save invoices locally instead of uploading them")
+    parser.add_argument("--butler-latency-ms", type=float, default=50, help="latency of the Butler stub")
+    parser.add_argument("--butler-error-rate", type=float, default=0.0, help="share of uploads answered with 503")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def run_benchmark(args):
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    workdir = tempfile.mkdtemp(prefix="mareon-bench-")
+    butler_stats = {'requests': 0, 'errors': 0, 'accepted': 0}
+    mandants = [f"Mandant {i + 1}" for i in range(args.accounts)]
+
+    portal, portal_url = serve(create_portal(
+        mandants, args.invoices, args.page_size, args.pdf_kb * 1024, args.browser_downloads
+    ))
+    butler, butler_url = serve(create_butler_stub(
+        args.butler_latency_ms / 1000.0, args.butler_error_rate, butler_stats
+    ))
+
+    # The application modules read their configuration at import time and use
+    # paths relative to the working directory, so both are set up first.
+    os.environ["MAREON_BASE_URL"] = portal_url
+    os.environ["BUTLER_API_URL"] = f"{butler_url}/v1/documents"
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "data", "app.db")
+    os.environ["SESSION_CACHE"] = "0"
+    os.environ.setdefault("BUTLER_RATE_LIMIT", "0")
+    if args.lean:
+        os.environ["BROWSER_LEAN"] = "1"
+    os.chdir(workdir)
+
+    import metrics
+    from database import init_db, add_account, get_write_stats
+    from log_sink import log_sink, setup_logging
+    from butler_api import get_client_metrics
+    from scraper import run_scraper
+
+    try:
+        init_db()
+        setup_logging()
+        # One login per account, so accounts form separate groups and --workers takes effect.
+        for i, mandant in enumerate(mandants):
+            add_account(
+                f"Bench {i + 1}", mandant, f"bench{i + 1}", "bench",
+                None if args.local_save else "bench-api-key",
+                os.path.join(workdir, "invoices") if args.local_save else None
+            )
+        log_sink.flush()
+
+        writes_before = get_write_stats()
+        start = time.perf_counter()
+        results = run_scraper(max_workers=args.workers, trigger='benchmark')
+        elapsed = time.perf_counter() - start
+        log_sink.flush()
+        writes_after = get_write_stats()
+
+        totals = {
+            key: sum(result[key] for result in results)
+            for key in ('processed', 'skipped', 'queued', 'failed')
+        }
+        phases = {}
+        for result in results:
+            for step, seconds in result['timings'].items():
+                phases[step] = phases.get(step, 0.0) + seconds
+
+        report = {
+            'accounts': args.accounts,
+            'invoices': args.invoices * args.accounts,
+            'elapsed_seconds': round(elapsed, 3),
+            'invoices_per_second': round(totals['processed'] / elapsed, 2) if elapsed else 0.0,
+            'results': totals,
+            'statuses': [result['status'] for result in results],
+            'phases_seconds': {step: round(seconds, 3) for step, seconds in sorted(phases.items())},
+            'phase_ms_per_invoice': {
+                step: round(seconds * 1000 / totals['processed'], 1) if totals['processed'] else None
+                for step, seconds in sorted(phases.items())
+            },
+            'peak_rss_mb': max((result.get('peak_rss_mb') or 0 for result in results), default=0) or None,
+            'db_writes': {
+                key: writes_after[key] - writes_before[key] for key in ('transactions', 'rows')
+            },
+            'butler_stub': butler_stats,
+            'butler_clients': get_client_metrics(),
+            'prometheus': metrics.render() if args.json else None,
+        }
+    finally:
+        portal.shutdown()
+        butler.shutdown()
+        os.chdir("/")
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return report
+
+
+def print_report(report):
+    print(f"Accounts:           {report['accounts']}")
+    print(f"Invoices:           {report['invoices']}")
+    print(f"Elapsed:            {report['elapsed_seconds']:.2f}s")
+    print(f"Throughput:         {report['invoices_per_second']:.2f} invoices/s")
+    print("Results:            " + ", ".join(f"{k}={v}" for k, v in report['results'].items()))
+    if report['peak_rss_mb']:
+        print(f"Peak browser RSS:   {report['peak_rss_mb']:.1f} MB")
+    print(f"DB writes:          {report['db_writes']['transactions']} transactions, {report['db_writes']['rows']} rows")
+    print(f"Butler stub:        {report['butler_stub']['requests']} requests, {report['butler_stub']['errors']} errors")
+    print("Phases:")
+    for step, seconds in report['phases_seconds'].items():
+        per_invoice = report['phase_ms_per_invoice'][step]
+        per_invoice = f"{per_invoice:.1f} ms/invoice" if per_invoice is not None else "-"
+        print(f"  {step:<18}{seconds:>9.2f}s  {per_invoice}")
+
+
+if __name__ == '__main__':
+    arguments = parse_args(sys.argv[1:])
+    benchmark_report = run_benchmark(arguments)
+    if arguments.json:
+        print(json.dumps(benchmark_report, indent=2))
+    else:
+        print_report(benchmark_report)
+    if not benchmark_report['statuses'] or any(status != 'ok' for status in benchmark_report['statuses']):
+        sys.exit(1)
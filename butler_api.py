@@ -1,44 +1,183 @@
 import requests
 import os
-from database import add_log
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
 
-BUTLER_API_URL = "https://api.buchhaltungsbutler.de/v1/documents"
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BUTLER_API_URL = os.environ.get("BUTLER_API_URL", "https://api.buchhaltungsbutler.de/v1/documents")
+BUTLER_MAX_ATTEMPTS = int(os.environ.get("BUTLER_MAX_ATTEMPTS", "5"))
+BUTLER_RATE_LIMIT = float(os.environ.get("BUTLER_RATE_LIMIT", "2"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+CONNECTION_POOL_SIZE = 8
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class ButlerClient:
+    def __init__(self, api_key, base_url=BUTLER_API_URL, max_attempts=BUTLER_MAX_ATTEMPTS,
+                 rate_limit=BUTLER_RATE_LIMIT, backoff_base=BACKOFF_BASE_SECONDS,
+                 backoff_max=BACKOFF_MAX_SECONDS, timeout=60, sleep=time.sleep):
+        self.base_url = base_url
+        self.max_attempts = max(1, max_attempts)
+        self.rate_limit = rate_limit
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._sleep = sleep
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONNECTION_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+        self._rate_lock = threading.Lock()
+        self._next_slot = 0.0
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'uploads': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'attempts': 0,
+            'retries': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+
+    def upload(self, filepath):
+        if not os.path.exists(filepath):
+            logger.error(f"File not found: {filepath}")
+            return False
 
-def upload_invoice(filepath, api_key):
-    if not os.path.exists(filepath):
-        add_log("ERROR", f"File not found: {filepath}")
-        return False
-    
-    try:
         filename = os.path.basename(filepath)
-        
-        with open(filepath, 'rb') as f:
-            files = {
-                'file': (filename, f, 'application/pdf')
-            }
-            headers = {
-                'Authorization': f'Bearer {api_key}'
-            }
-            
-            add_log("INFO", f"Uploading invoice to Buchhaltungsbutler: {filename}")
-            
-            response = requests.post(
-                BUTLER_API_URL,
-                headers=headers,
-                files=files,
-                timeout=60
-            )
-            
-            if response.status_code in [200, 201]:
-                add_log("INFO", f"Successfully uploaded invoice: {filename}")
-                return True
-            else:
-                add_log("ERROR", f"Failed to upload invoice: {filename}. Status: {response.status_code}, Response: {response.text}")
-                return False
-                
-    except requests.exceptions.RequestException as e:
-        add_log("ERROR", f"Network error uploading invoice: {str(e)}")
-        return False
-    except Exception as e:
-        add_log("ERROR", f"Error uploading invoice: {str(e)}")
+        logger.info(f"Uploading invoice to Buchhaltungsbutler: {filename}")
+        self._record(uploads=1)
+        upload_start = time.perf_counter()
+
+        for attempt in range(1, self.max_attempts + 1):
+            self._wait_for_rate_limit()
+            start = time.perf_counter()
+            retry_delay = None
+
+            try:
+                with open(filepath, 'rb') as f:
+                    response = self.session.post(
+                        self.base_url,
+                        files={'file': (filename, f, 'application/pdf')},
+                        timeout=self.timeout
+                    )
+                self._record_attempt(time.perf_counter() - start)
+
+                if response.status_code in [200, 201]:
+                    logger.info(f"Successfully uploaded invoice: {filename}")
+                    self._record(succeeded=1)
+                    metrics.observe('butler_upload_duration_seconds', time.perf_counter() - upload_start, outcome='success')
+                    return True
+
+                if response.status_code not in RETRY_STATUS_CODES:
+                    logger.error(f"Failed to upload invoice: {filename}. Status: {response.status_code}, Response: {response.text}")
+                    break
+
+                retry_delay = self._retry_after(response)
+                problem = f"status {response.status_code}"
+
+            except requests.exceptions.RequestException as e:
+                self._record_attempt(time.perf_counter() - start)
+                problem = f"network error: {str(e)}"
+            except Exception as e:
+                logger.error(f"Error uploading invoice: {str(e)}")
+                break
+
+            if attempt == self.max_attempts:
+                logger.error(f"Giving up uploading invoice {filename} after {attempt} attempts ({problem})")
+                break
+
+            delay = retry_delay if retry_delay is not None else self._backoff(attempt)
+            logger.info(f"Upload of {filename} failed ({problem}), retrying in {delay:.1f}s")
+            self._record(retries=1)
+            self._sleep(delay)
+
+        self._record(failed=1)
+        metrics.observe('butler_upload_duration_seconds', time.perf_counter() - upload_start, outcome='failure')
         return False
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics['latency_avg'] = metrics['latency_total'] / metrics['attempts'] if metrics['attempts'] else 0.0
+        return metrics
+
+    def close(self):
+        self.session.close()
+
+    def _backoff(self, attempt):
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        return min(max(seconds, 0.0), self.backoff_max)
+
+    def _wait_for_rate_limit(self):
+        if not self.rate_limit:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate_limit
+        if slot > now:
+            self._sleep(slot - now)
+
+    def _record_attempt(self, latency):
+        with self._metrics_lock:
+            self._metrics['attempts'] += 1
+            self._metrics['latency_total'] += latency
+            self._metrics['latency_max'] = max(self._metrics['latency_max'], latency)
+
+    def _record(self, **counts):
+        with self._metrics_lock:
+            for name, value in counts.items():
+                self._metrics[name] += value
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key):
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = ButlerClient(api_key)
+            _clients[api_key] = client
+        return client
+
+
+def get_client_metrics():
+    with _clients_lock:
+        clients = dict(_clients)
+    return {f"...{api_key[-4:]}": client.get_metrics() for api_key, client in clients.items()}
+
+
+def upload_invoice(filepath, api_key):
+    return get_client(api_key).upload(filepath)
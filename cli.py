@@ -0,0 +1,75 @@
+import sys
+import json
+import logging
+import argparse
+from datetime import date
+
+from database import init_db, get_all_accounts
+from log_sink import log_sink, setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run the Mareon invoice scraper without the web interface")
+    parser.add_argument("--quiet", action="store_true", help="do not echo log messages to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="scrape invoices and print one JSON result per account")
+    run.add_argument("--account", action="append", metavar="NAME", help="only this account (repeatable, default: all)")
+    run.add_argument("--since", type=date.fromisoformat, metavar="YYYY-MM-DD",
+                     help="look at invoices dated on or after this day instead of stopping at the last seen one")
+    run.add_argument("--dry-run", action="store_true",
+                     help="list the invoices that would be processed without downloading or delivering them")
+    run.add_argument("--workers", type=int, default=None, help="scraper workers (default: SCRAPER_MAX_WORKERS)")
+
+    commands.add_parser("drain", help="retry the deliveries waiting in the outbox")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    account_ids = None
+    if args.account:
+        accounts = {account['name']: account['id'] for account in get_all_accounts()}
+        unknown = [name for name in args.account if name not in accounts]
+        if unknown:
+            logger.error(f"Unknown account(s): {', '.join(unknown)}")
+            return 2
+        account_ids = {accounts[name] for name in args.account}
+
+    from scraper import run_scraper
+    results = run_scraper(
+        max_workers=args.workers, account_ids=account_ids, trigger='cli', since=args.since, dry_run=args.dry_run
+    )
+    for result in results:
+        print(json.dumps(result), flush=True)
+    return 0 if results and all(result['status'] in ('ok', 'leased') for result in results) else 1
+
+
+def drain(args):
+    from delivery import drain_outbox
+    delivered, failed = drain_outbox(limit=1000)
+    print(json.dumps({'delivered': delivered, 'failed': failed}), flush=True)
+    return 0 if failed == 0 else 1
+
+
+COMMANDS = {
+    'run': run,
+    'drain': drain,
+}
+
+
+if __name__ == '__main__':
+    arguments = parse_args(sys.argv[1:])
+    init_db()
+    setup_logging()
+    # stdout carries the JSON results; log messages go to stderr.
+    if not arguments.quiet:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s"))
+        logging.getLogger().addHandler(handler)
+    try:
+        exit_code = COMMANDS[arguments.command](arguments)
+    finally:
+        log_sink.flush()
+    sys.exit(exit_code)
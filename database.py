@@ -1,22 +1,68 @@
 import sqlite3
 import os
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
-DB_PATH = "data/app.db"
+DB_PATH = os.environ.get("DATABASE_PATH", "data/app.db")
+BUSY_TIMEOUT_SECONDS = 30
+
+_local = threading.local()
+_write_stats = {'transactions': 0, 'rows': 0}
+_write_stats_lock = threading.Lock()
 
 def ensure_db_folder():
-    os.makedirs("data", exist_ok=True)
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
 
 def get_connection():
-    ensure_db_folder()
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        ensure_db_folder()
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_SECONDS)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _local.depth = 0
     return conn
 
-def init_db():
+def close_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+        _local.depth = 0
+
+@contextmanager
+def transaction():
     conn = get_connection()
-    cursor = conn.cursor()
-    
+    if _local.depth == 0:
+        _local.changes = conn.total_changes
+    _local.depth += 1
+    try:
+        yield conn
+    except Exception:
+        _local.depth -= 1
+        if _local.depth == 0:
+            conn.rollback()
+        raise
+    _local.depth -= 1
+    if _local.depth == 0:
+        conn.commit()
+        with _write_stats_lock:
+            _write_stats['transactions'] += 1
+            _write_stats['rows'] += conn.total_changes - _local.changes
+
+def get_write_stats():
+    with _write_stats_lock:
+        return dict(_write_stats)
+
+def init_db():
+    with transaction() as conn:
+        _create_schema(conn.cursor())
+
+def _create_schema(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS accounts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,9 +84,120 @@ def init_db():
     if 'butler_api_key' in columns:
         pass
     
+    if 'interval_minutes' not in columns:
+        cursor.execute('ALTER TABLE accounts ADD COLUMN interval_minutes INTEGER')
+    
+    if 'last_run_at' not in columns:
+        cursor.execute('ALTER TABLE accounts ADD COLUMN last_run_at TEXT')
+    
+    if 'last_run_owner' not in columns:
+        cursor.execute('ALTER TABLE accounts ADD COLUMN last_run_owner TEXT')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL UNIQUE,
+            trigger TEXT NOT NULL,
+            status TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            accounts INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            queued INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    cursor.execute("PRAGMA table_info(runs)")
+    run_columns = [col[1] for col in cursor.fetchall()]
+    
+    if 'owner' not in run_columns:
+        cursor.execute('ALTER TABLE runs ADD COLUMN owner TEXT')
+    
+    if 'heartbeat_at' not in run_columns:
+        cursor.execute('ALTER TABLE runs ADD COLUMN heartbeat_at REAL')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS run_accounts (
+            run_id TEXT NOT NULL,
+            account_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            page INTEGER NOT NULL DEFAULT 1,
+            processed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            queued INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (run_id, account_id)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS run_metrics (
+            run_id TEXT NOT NULL,
+            account_id INTEGER,
+            name TEXT NOT NULL,
+            value REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_run_metrics_run_id ON run_metrics (run_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_run_metrics_name ON run_metrics (name, account_id)')
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS history (
-            rechnungs_nr TEXT PRIMARY KEY
+            rechnungs_nr TEXT PRIMARY KEY,
+            content_hash TEXT
+        )
+    ''')
+    
+    cursor.execute("PRAGMA table_info(history)")
+    history_columns = [col[1] for col in cursor.fetchall()]
+    
+    if 'content_hash' not in history_columns:
+        cursor.execute('ALTER TABLE history ADD COLUMN content_hash TEXT')
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_content_hash ON history (content_hash)')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rechnungs_nr TEXT NOT NULL UNIQUE,
+            account_id INTEGER NOT NULL,
+            spool_path TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            next_attempt_at TEXT NOT NULL
+        )
+    ''')
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_next_attempt ON outbox (next_attempt_at)')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS account_state (
+            account_id INTEGER PRIMARY KEY,
+            last_invoice_nr TEXT,
+            last_invoice_date TEXT,
+            updated_at TEXT
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS account_leases (
+            account_id INTEGER PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_claims (
+            rechnungs_nr TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
         )
     ''')
     
@@ -49,75 +206,396 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp TEXT NOT NULL,
             level TEXT NOT NULL,
-            message TEXT NOT NULL
+            message TEXT NOT NULL,
+            run_id TEXT,
+            account_id INTEGER
         )
     ''')
     
-    conn.commit()
-    conn.close()
+    cursor.execute("PRAGMA table_info(logs)")
+    log_columns = [col[1] for col in cursor.fetchall()]
+    
+    if 'run_id' not in log_columns:
+        cursor.execute('ALTER TABLE logs ADD COLUMN run_id TEXT')
+    
+    if 'account_id' not in log_columns:
+        cursor.execute('ALTER TABLE logs ADD COLUMN account_id INTEGER')
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_level ON logs (level, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_run_id ON logs (run_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_account_id ON logs (account_id, id)')
 
-def add_account(name, mandant_dropdown, username, password, butler_api_key, save_path):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO accounts (name, mandant_dropdown, username, password, butler_api_key, save_path)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (name, mandant_dropdown, username, password, butler_api_key, save_path))
-    conn.commit()
-    conn.close()
+def add_account(name, mandant_dropdown, username, password, butler_api_key, save_path, interval_minutes=None):
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO accounts (name, mandant_dropdown, username, password, butler_api_key, save_path, interval_minutes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (name, mandant_dropdown, username, password, butler_api_key, save_path, interval_minutes))
 
 def get_all_accounts():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM accounts')
-    accounts = cursor.fetchall()
-    conn.close()
-    return accounts
+    return get_connection().execute('SELECT * FROM accounts').fetchall()
+
+def get_account(account_id):
+    return get_connection().execute('SELECT * FROM accounts WHERE id = ?', (account_id,)).fetchone()
 
 def delete_account(account_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM accounts WHERE id = ?', (account_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM accounts WHERE id = ?', (account_id,))
+        conn.execute('DELETE FROM account_state WHERE account_id = ?', (account_id,))
+
+def set_account_last_run(account_ids, last_run_at, owner=None):
+    with transaction() as conn:
+        conn.executemany(
+            'UPDATE accounts SET last_run_at = ?, last_run_owner = ? WHERE id = ?',
+            [(last_run_at, owner, account_id) for account_id in account_ids]
+        )
+
+def start_run(run_id, trigger, account_count, owner=None):
+    started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO runs (run_id, trigger, status, started_at, accounts, owner, heartbeat_at)
+            VALUES (?, ?, 'running', ?, ?, ?, ?)
+        ''', (run_id, trigger, started_at, account_count, owner, time.time()))
+    return started_at
+
+def touch_run(run_id, owner):
+    with transaction() as conn:
+        conn.execute('UPDATE runs SET heartbeat_at = ? WHERE run_id = ? AND owner = ?', (time.time(), run_id, owner))
+
+# A run counts as abandoned once its heartbeat is older than stale_seconds and its
+# owner holds no live account leases. Leases left behind by an earlier process
+# under the same instance id do not count.
+ABANDONED_RUN_CONDITION = '''
+    status = 'running'
+    AND (heartbeat_at IS NULL OR heartbeat_at < :stale_before)
+    AND (owner IS NULL OR owner = :owner OR NOT EXISTS (
+        SELECT 1 FROM account_leases WHERE account_leases.owner = runs.owner AND account_leases.expires_at >= :now
+    ))
+'''
+
+def finish_run(run_id, status, processed, skipped, queued, failed):
+    finished_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE runs SET status = ?, finished_at = ?, processed = ?, skipped = ?, queued = ?, failed = ?
+            WHERE run_id = ?
+        ''', (status, finished_at, processed, skipped, queued, failed, run_id))
+
+def get_recent_runs(limit=20):
+    return get_connection().execute('SELECT * FROM runs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+
+def get_run(run_id):
+    return get_connection().execute('SELECT * FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+
+def get_interrupted_runs(owner, stale_seconds):
+    now = time.time()
+    return get_connection().execute(
+        f'SELECT * FROM runs WHERE {ABANDONED_RUN_CONDITION} ORDER BY id',
+        {'owner': owner, 'now': now, 'stale_before': now - stale_seconds}
+    ).fetchall()
+
+def take_over_run(run_id, owner, stale_seconds):
+    now = time.time()
+    with transaction() as conn:
+        cursor = conn.execute(
+            f'UPDATE runs SET owner = :owner, heartbeat_at = :now WHERE run_id = :run_id AND {ABANDONED_RUN_CONDITION}',
+            {'owner': owner, 'now': now, 'stale_before': now - stale_seconds, 'run_id': run_id}
+        )
+        return cursor.rowcount == 1
+
+def add_run_accounts(run_id, account_ids):
+    updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO run_accounts (run_id, account_id, updated_at) VALUES (?, ?, ?)',
+            [(run_id, account_id, updated_at) for account_id in account_ids]
+        )
+
+def get_run_accounts(run_id):
+    return get_connection().execute('SELECT * FROM run_accounts WHERE run_id = ?', (run_id,)).fetchall()
+
+def get_run_account(run_id, account_id):
+    return get_connection().execute(
+        'SELECT * FROM run_accounts WHERE run_id = ? AND account_id = ?', (run_id, account_id)
+    ).fetchone()
+
+def set_run_account_page(run_id, account_id, page):
+    updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE run_accounts SET status = 'running', page = ?, updated_at = ?
+            WHERE run_id = ? AND account_id = ?
+        ''', (page, updated_at, run_id, account_id))
+
+def finish_run_account(run_id, account_id, status, processed, skipped, queued, failed, error=None):
+    updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE run_accounts
+            SET status = ?, processed = ?, skipped = ?, queued = ?, failed = ?, error = ?, updated_at = ?
+            WHERE run_id = ? AND account_id = ?
+        ''', (status, processed, skipped, queued, failed, error, updated_at, run_id, account_id))
+
+def add_run_metrics(run_id, entries):
+    with transaction() as conn:
+        conn.executemany(
+            'INSERT INTO run_metrics (run_id, account_id, name, value) VALUES (?, ?, ?, ?)',
+            [(run_id, account_id, name, value) for account_id, name, value in entries]
+        )
+
+def get_run_metrics(run_id):
+    return get_connection().execute(
+        'SELECT account_id, name, value FROM run_metrics WHERE run_id = ? ORDER BY account_id, name', (run_id,)
+    ).fetchall()
+
+def get_metric_trend(name, account_id=None, limit=20):
+    return get_connection().execute('''
+        SELECT runs.run_id, runs.started_at, SUM(run_metrics.value) AS value
+        FROM run_metrics JOIN runs ON runs.run_id = run_metrics.run_id
+        WHERE run_metrics.name = ? AND (? IS NULL OR run_metrics.account_id = ?)
+        GROUP BY runs.id
+        ORDER BY runs.id DESC
+        LIMIT ?
+    ''', (name, account_id, account_id, limit)).fetchall()
+
+def get_high_water_mark(account_id):
+    return get_connection().execute(
+        'SELECT * FROM account_state WHERE account_id = ?', (account_id,)
+    ).fetchone()
+
+def set_high_water_mark(account_id, last_invoice_nr, last_invoice_date):
+    updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO account_state (account_id, last_invoice_nr, last_invoice_date, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(account_id) DO UPDATE SET
+                last_invoice_nr = excluded.last_invoice_nr,
+                last_invoice_date = excluded.last_invoice_date,
+                updated_at = excluded.updated_at
+        ''', (account_id, last_invoice_nr, last_invoice_date, updated_at))
 
 def is_invoice_processed(rechnungs_nr):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM history WHERE rechnungs_nr = ?', (rechnungs_nr,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    cursor = get_connection().execute('SELECT 1 FROM history WHERE rechnungs_nr = ?', (rechnungs_nr,))
+    return cursor.fetchone() is not None
 
-def add_to_history(rechnungs_nr):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO history (rechnungs_nr) VALUES (?)', (rechnungs_nr,))
-    conn.commit()
-    conn.close()
+def iter_history():
+    cursor = get_connection().execute('SELECT rechnungs_nr FROM history')
+    for row in cursor:
+        yield row[0]
 
-def add_log(level, message):
+def get_invoice_by_content_hash(content_hash):
+    row = get_connection().execute(
+        'SELECT rechnungs_nr FROM history WHERE content_hash = ? LIMIT 1', (content_hash,)
+    ).fetchone()
+    return row[0] if row else None
+
+def add_to_history(rechnungs_nr, content_hash=None):
+    add_to_history_batch([(rechnungs_nr, content_hash)])
+
+def add_to_history_batch(entries):
+    with transaction() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO history (rechnungs_nr, content_hash) VALUES (?, ?)',
+            entries
+        )
+        conn.executemany(
+            'DELETE FROM invoice_claims WHERE rechnungs_nr = ?',
+            [(entry[0],) for entry in entries]
+        )
+
+def claim_invoice(rechnungs_nr, owner, ttl_seconds):
+    now = time.time()
+    with transaction() as conn:
+        # One statement, so the history/outbox check and the claim cannot interleave with another instance.
+        cursor = conn.execute('''
+            INSERT INTO invoice_claims (rechnungs_nr, owner, expires_at)
+            SELECT ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM history WHERE rechnungs_nr = ?)
+              AND NOT EXISTS (SELECT 1 FROM outbox WHERE rechnungs_nr = ?)
+            ON CONFLICT(rechnungs_nr) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE invoice_claims.owner = excluded.owner OR invoice_claims.expires_at < ?
+        ''', (rechnungs_nr, owner, now + ttl_seconds, rechnungs_nr, rechnungs_nr, now))
+        if cursor.rowcount == 1:
+            return 'claimed'
+    
     conn = get_connection()
-    cursor = conn.cursor()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute('''
-        INSERT INTO logs (timestamp, level, message)
-        VALUES (?, ?, ?)
-    ''', (timestamp, level, message))
-    conn.commit()
-    conn.close()
+    if conn.execute('SELECT 1 FROM history WHERE rechnungs_nr = ?', (rechnungs_nr,)).fetchone():
+        return 'processed'
+    if conn.execute('SELECT 1 FROM outbox WHERE rechnungs_nr = ?', (rechnungs_nr,)).fetchone():
+        return 'queued'
+    return 'taken'
+
+def release_invoice_claims(owner):
+    with transaction() as conn:
+        conn.execute('DELETE FROM invoice_claims WHERE owner = ?', (owner,))
+
+def claim_account(account_id, owner, ttl_seconds):
+    now = time.time()
+    with transaction() as conn:
+        cursor = conn.execute('''
+            INSERT INTO account_leases (account_id, owner, expires_at, heartbeat_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(account_id) DO UPDATE SET
+                owner = excluded.owner, expires_at = excluded.expires_at, heartbeat_at = excluded.heartbeat_at
+            WHERE account_leases.owner = excluded.owner OR account_leases.expires_at < ?
+        ''', (account_id, owner, now + ttl_seconds, now, now))
+        return cursor.rowcount == 1
+
+def renew_account_leases(owner, account_ids, ttl_seconds):
+    now = time.time()
+    with transaction() as conn:
+        cursor = conn.executemany(
+            'UPDATE account_leases SET expires_at = ?, heartbeat_at = ? WHERE account_id = ? AND owner = ?',
+            [(now + ttl_seconds, now, account_id, owner) for account_id in account_ids]
+        )
+        return cursor.rowcount
+
+def release_account_leases(owner, account_ids):
+    with transaction() as conn:
+        conn.executemany(
+            'DELETE FROM account_leases WHERE account_id = ? AND owner = ?',
+            [(account_id, owner) for account_id in account_ids]
+        )
+
+def get_account_leases():
+    return get_connection().execute('SELECT * FROM account_leases ORDER BY account_id').fetchall()
+
+def add_to_outbox(rechnungs_nr, account_id, spool_path, error):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO outbox (rechnungs_nr, account_id, spool_path, attempts, last_error, created_at, next_attempt_at)
+            VALUES (?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT(rechnungs_nr) DO UPDATE SET
+                account_id = excluded.account_id,
+                spool_path = excluded.spool_path,
+                attempts = outbox.attempts + 1,
+                last_error = excluded.last_error
+        ''', (rechnungs_nr, account_id, spool_path, error, now, now))
+        conn.execute('DELETE FROM invoice_claims WHERE rechnungs_nr = ?', (rechnungs_nr,))
+
+def iter_outbox_invoice_numbers():
+    cursor = get_connection().execute('SELECT rechnungs_nr FROM outbox')
+    for row in cursor:
+        yield row[0]
+
+def claim_outbox_entry(outbox_id, next_attempt_at, lease_seconds):
+    leased_until = (datetime.now() + timedelta(seconds=lease_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        cursor = conn.execute(
+            'UPDATE outbox SET next_attempt_at = ? WHERE id = ? AND next_attempt_at = ?',
+            (leased_until, outbox_id, next_attempt_at)
+        )
+        return cursor.rowcount == 1
+
+def get_due_outbox(limit=100):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return get_connection().execute(
+        'SELECT * FROM outbox WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?', (now, limit)
+    ).fetchall()
+
+def get_outbox_count():
+    return get_connection().execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+def reschedule_outbox(outbox_id, error, retry_in_seconds):
+    next_attempt_at = (datetime.now() + timedelta(seconds=retry_in_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?
+            WHERE id = ?
+        ''', (error, next_attempt_at, outbox_id))
+
+def complete_outbox(outbox_id, rechnungs_nr, content_hash=None):
+    with transaction() as conn:
+        conn.execute(
+            'INSERT OR IGNORE INTO history (rechnungs_nr, content_hash) VALUES (?, ?)',
+            (rechnungs_nr, content_hash)
+        )
+        conn.execute('DELETE FROM outbox WHERE id = ?', (outbox_id,))
+
+def remove_from_outbox(outbox_id):
+    with transaction() as conn:
+        conn.execute('DELETE FROM outbox WHERE id = ?', (outbox_id,))
+
+def add_logs_batch(records):
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO logs (timestamp, level, message, run_id, account_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', records)
+
+def get_max_log_id():
+    row = get_connection().execute('SELECT MAX(id) FROM logs').fetchone()
+    return row[0] or 0
 
 def get_logs(limit=100):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM logs ORDER BY id DESC LIMIT ?', (limit,))
-    logs = cursor.fetchall()
-    conn.close()
-    return logs
+    return get_connection().execute('SELECT * FROM logs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+
+def get_logs_after(last_id, limit=1000):
+    return get_connection().execute('SELECT * FROM logs WHERE id > ? ORDER BY id LIMIT ?', (last_id, limit)).fetchall()
+
+def query_logs(since_id=None, before_id=None, level=None, account_id=None, run_id=None, limit=100):
+    conditions = []
+    params = []
+    
+    if since_id is not None:
+        conditions.append('id > ?')
+        params.append(since_id)
+    if before_id is not None:
+        conditions.append('id < ?')
+        params.append(before_id)
+    if level:
+        conditions.append('level = ?')
+        params.append(level)
+    if account_id is not None:
+        conditions.append('account_id = ?')
+        params.append(account_id)
+    if run_id:
+        conditions.append('run_id = ?')
+        params.append(run_id)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    # Forward cursors return the rows directly after since_id so clients can page through a backlog.
+    order = 'ASC' if since_id is not None and before_id is None else 'DESC'
+    params.append(limit)
+    
+    rows = get_connection().execute(
+        f'SELECT * FROM logs {where} ORDER BY id {order} LIMIT ?', params
+    ).fetchall()
+    if order == 'ASC':
+        rows.reverse()
+    return rows
+
+def prune_logs(max_age_days, max_rows, batch_size=1000):
+    deleted = 0
+    
+    with transaction() as conn:
+        if max_age_days:
+            cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+            cursor = conn.execute('''
+                DELETE FROM logs WHERE id IN (
+                    SELECT id FROM logs WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+                )
+            ''', (cutoff, batch_size))
+            deleted += cursor.rowcount
+        
+        if max_rows and deleted < batch_size:
+            row = conn.execute(
+                'SELECT id FROM logs ORDER BY id DESC LIMIT 1 OFFSET ?', (max_rows,)
+            ).fetchone()
+            if row:
+                cursor = conn.execute('''
+                    DELETE FROM logs WHERE id IN (
+                        SELECT id FROM logs WHERE id <= ? ORDER BY id LIMIT ?
+                    )
+                ''', (row[0], batch_size - deleted))
+                deleted += cursor.rowcount
+    
+    return deleted
 
 def clear_logs():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM logs')
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM logs')
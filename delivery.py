@@ -0,0 +1,250 @@
+import os
+import hashlib
+import logging
+import queue
+import shutil
+import threading
+import time
+
+from butler_api import upload_invoice
+from database import (
+    init_db, get_account, add_to_outbox, get_due_outbox, reschedule_outbox, complete_outbox, remove_from_outbox,
+    get_invoice_by_content_hash, claim_outbox_entry
+)
+from log_sink import log_context, get_log_context, setup_logging
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "4"))
+UPLOAD_QUEUE_SIZE = int(os.environ.get("UPLOAD_QUEUE_SIZE", "8"))
+SPOOL_DIR = os.path.abspath(os.path.join("data", "spool"))
+OUTBOX_RETRY_BASE_SECONDS = 60
+OUTBOX_RETRY_MAX_SECONDS = 6 * 60 * 60
+OUTBOX_CLAIM_SECONDS = 15 * 60
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_to_local_path(filepath, save_path, invoice_nr, content_hash=None):
+    try:
+        os.makedirs(save_path, exist_ok=True)
+        
+        filename = os.path.basename(filepath)
+        base, ext = os.path.splitext(filename)
+        content_hash = content_hash or hash_file(filepath)
+        
+        dest_path = os.path.join(save_path, f"{invoice_nr}{ext}" if invoice_nr else filename)
+        if os.path.exists(dest_path) and hash_file(dest_path) != content_hash:
+            # The name is taken by different content; the hash makes the second name unique.
+            dest_path = os.path.join(save_path, f"{invoice_nr or base}_{content_hash[:12]}{ext}")
+        
+        if os.path.exists(dest_path):
+            os.remove(filepath)
+            logger.info(f"Identical invoice already stored at: {dest_path}")
+            return True
+        
+        shutil.move(filepath, dest_path)
+        logger.info(f"Saved invoice to: {dest_path}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to save invoice locally: {str(e)}")
+        return False
+
+def deliver_invoice(downloaded_file, invoice_nr, api_key, save_path, content_hash=None):
+    if api_key:
+        if upload_invoice(downloaded_file, api_key):
+            try:
+                os.remove(downloaded_file)
+                logger.info(f"Deleted local file after upload: {downloaded_file}")
+            except Exception as e:
+                logger.error(f"Could not delete file: {str(e)}")
+            return True
+        logger.error(f"Upload failed for invoice: {invoice_nr}")
+
+    elif save_path:
+        if save_to_local_path(downloaded_file, save_path, invoice_nr, content_hash):
+            return True
+        logger.error(f"Save failed for invoice: {invoice_nr}")
+
+    else:
+        logger.error(f"No API key or save path configured for invoice: {invoice_nr}")
+
+    return False
+
+def spool_invoice(downloaded_file, invoice_nr, account_id, error):
+    try:
+        spool_folder = os.path.join(SPOOL_DIR, invoice_nr)
+        os.makedirs(spool_folder, exist_ok=True)
+        spool_path = os.path.join(spool_folder, os.path.basename(downloaded_file))
+        shutil.move(downloaded_file, spool_path)
+        add_to_outbox(invoice_nr, account_id, spool_path, error)
+        logger.info(f"Queued invoice {invoice_nr} for a later delivery retry")
+        return True
+    except Exception as e:
+        logger.error(f"Could not queue invoice {invoice_nr} for retry: {str(e)}")
+        try:
+            if os.path.exists(downloaded_file):
+                os.remove(downloaded_file)
+                logger.info(f"Cleaned up failed file: {downloaded_file}")
+        except Exception:
+            pass
+        return False
+
+def remove_spool_file(spool_path):
+    try:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        os.rmdir(os.path.dirname(spool_path))
+    except OSError:
+        pass
+
+def drain_outbox(limit=100):
+    entries = get_due_outbox(limit)
+    if not entries:
+        return 0, 0
+
+    logger.info(f"Retrying delivery of {len(entries)} queued invoice(s)")
+    delivered = 0
+    failed = 0
+
+    for entry in entries:
+        invoice_nr = entry['rechnungs_nr']
+        
+        # Another bot instance may be draining the same outbox; only one of them gets each entry.
+        if not claim_outbox_entry(entry['id'], entry['next_attempt_at'], OUTBOX_CLAIM_SECONDS):
+            continue
+
+        with log_context(account_id=entry['account_id']):
+            account = get_account(entry['account_id'])
+            if account is None:
+                logger.error(f"Dropping queued invoice {invoice_nr}: account no longer exists")
+                remove_spool_file(entry['spool_path'])
+                remove_from_outbox(entry['id'])
+                failed += 1
+                continue
+
+            if not os.path.exists(entry['spool_path']):
+                logger.error(f"Dropping queued invoice {invoice_nr}: spooled file is missing")
+                remove_from_outbox(entry['id'])
+                failed += 1
+                continue
+
+            try:
+                content_hash = hash_file(entry['spool_path'])
+                duplicate_of = get_invoice_by_content_hash(content_hash)
+                if duplicate_of and duplicate_of != invoice_nr:
+                    logger.info(f"Queued invoice {invoice_nr} has the same content as {duplicate_of}, not delivering it again")
+                    success = True
+                else:
+                    success = deliver_invoice(
+                        entry['spool_path'], invoice_nr, account['butler_api_key'], account['save_path'], content_hash
+                    )
+            except Exception as e:
+                logger.error(f"Error delivering queued invoice {invoice_nr}: {str(e)}")
+                content_hash = None
+                success = False
+
+            if success:
+                complete_outbox(entry['id'], invoice_nr, content_hash)
+                remove_spool_file(entry['spool_path'])
+                logger.info(f"Delivered queued invoice: {invoice_nr}")
+                delivered += 1
+            else:
+                retry_in = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * (2 ** entry['attempts']))
+                reschedule_outbox(entry['id'], "Delivery failed", retry_in)
+                failed += 1
+
+    logger.info(f"Outbox drain finished: {delivered} delivered, {failed} still pending or dropped")
+    return delivered, failed
+
+
+class DeliveryPipeline:
+    def __init__(self, history, account_id, api_key, save_path, workers=UPLOAD_WORKERS,
+                 queue_size=UPLOAD_QUEUE_SIZE, timings=None):
+        self.history = history
+        self.account_id = account_id
+        self.api_key = api_key
+        self.save_path = save_path
+        self.timings = timings
+        self.processed = 0
+        self.failed = 0
+        self.queued = 0
+        self.duplicates = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"delivery-worker-{i}", daemon=True)
+            for i in range(1, max(1, workers) + 1)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, downloaded_file, invoice_nr):
+        self._queue.put((downloaded_file, invoice_nr, get_log_context()))
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        return self.processed, self.failed, self.queued, self.duplicates
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            downloaded_file, invoice_nr, (run_id, account_id) = job
+            with log_context(run_id=run_id, account_id=account_id):
+                start = time.perf_counter()
+                duplicate_of = None
+                content_hash = None
+                try:
+                    content_hash = hash_file(downloaded_file)
+                    duplicate_of = self.history.claim_content(content_hash, invoice_nr)
+                    if duplicate_of:
+                        logger.info(f"Invoice {invoice_nr} has the same content as {duplicate_of}, not delivering it again")
+                        os.remove(downloaded_file)
+                        success = True
+                    else:
+                        success = deliver_invoice(
+                            downloaded_file, invoice_nr, self.api_key, self.save_path, content_hash
+                        )
+                except Exception as e:
+                    logger.error(f"Error delivering invoice {invoice_nr}: {str(e)}")
+                    success = False
+
+                if success:
+                    self.history.add(invoice_nr, content_hash)
+                    queued = False
+                else:
+                    if content_hash:
+                        self.history.release_content(content_hash, invoice_nr)
+                    queued = spool_invoice(downloaded_file, invoice_nr, self.account_id, "Delivery failed")
+                    if queued:
+                        self.history.mark_queued(invoice_nr)
+
+                with self._lock:
+                    if duplicate_of:
+                        self.duplicates += 1
+                    elif success:
+                        self.processed += 1
+                    elif queued:
+                        self.queued += 1
+                    else:
+                        self.failed += 1
+                    if self.timings is not None:
+                        self.timings['deliver'] = self.timings.get('deliver', 0.0) + time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)s] %(message)s")
+    init_db()
+    setup_logging()
+    drain_outbox(limit=1000)
@@ -0,0 +1,180 @@
+import os
+import glob
+import time
+import ctypes
+import ctypes.util
+import logging
+import select
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_EVENTS_ENABLED = os.environ.get("DOWNLOAD_EVENTS", "1") != "0"
+POLL_INTERVAL = 0.05
+PARTIAL_SUFFIXES = ('.crdownload', '.part', '.tmp')
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.inotify_init1
+            libc.inotify_add_watch
+        except (OSError, AttributeError):
+            libc = False
+        _libc = libc
+    return _libc or None
+
+
+def is_complete_pdf(name):
+    return name.lower().endswith('.pdf') and not name.endswith(PARTIAL_SUFFIXES)
+
+
+# Chrome writes `<name>.crdownload` and renames it to the final name once the
+# download is complete, which inotify reports as IN_MOVED_TO. Each completed file
+# is handed to exactly one waiter, oldest first, so it is matched to the click
+# that started it. Without inotify the directory is polled instead.
+class DownloadWatcher:
+    def __init__(self, download_dir):
+        self.download_dir = download_dir
+        self._fd = None
+        self._thread = None
+        self._closed = False
+        self._stopped = False
+        self._events = []
+        self._claimed = set()
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    @property
+    def uses_events(self):
+        return self._fd is not None and not self._stopped
+
+    def start(self):
+        os.makedirs(self.download_dir, exist_ok=True)
+        libc = _load_libc() if DOWNLOAD_EVENTS_ENABLED else None
+        if libc is None:
+            return self
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logger.info(f"inotify unavailable ({os.strerror(ctypes.get_errno())}), polling for downloads")
+            return self
+        if libc.inotify_add_watch(fd, os.fsencode(self.download_dir), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            logger.info(f"Cannot watch {self.download_dir} ({os.strerror(ctypes.get_errno())}), polling for downloads")
+            os.close(fd)
+            return self
+
+        self._fd = fd
+        self._thread = threading.Thread(target=self._run, name="download-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed = True
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def mark(self):
+        if self.uses_events:
+            with self._condition:
+                return self._sequence
+        return set(glob.glob(os.path.join(self.download_dir, "*.pdf")))
+
+    def wait(self, mark, timeout=30):
+        if not self.uses_events:
+            return self._poll(mark, timeout)
+
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                for i, (sequence, path) in enumerate(self._events):
+                    if sequence > mark and os.path.exists(path):
+                        del self._events[i]
+                        self._claimed.add(path)
+                        return path
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopped:
+                    return None
+                self._condition.wait(remaining)
+
+    def _poll(self, existing_files, timeout):
+        end_time = time.monotonic() + timeout
+        while time.monotonic() < end_time:
+            current_files = set(glob.glob(os.path.join(self.download_dir, "*.pdf")))
+            completed = [f for f in current_files - existing_files if is_complete_pdf(os.path.basename(f))]
+            if completed:
+                return min(completed, key=os.path.getmtime)
+            time.sleep(POLL_INTERVAL)
+        return None
+
+    def _record(self, names, rescan=False):
+        with self._condition:
+            self._claimed = {path for path in self._claimed if os.path.exists(path)}
+            known = {path for _, path in self._events} | self._claimed
+            for name in names:
+                path = os.path.join(self.download_dir, name)
+                if rescan and path in known:
+                    continue
+                self._sequence += 1
+                self._events.append((self._sequence, path))
+            # Keep the backlog small; unclaimed files from other writers are dropped.
+            del self._events[:-100]
+            self._condition.notify_all()
+
+    def _run(self):
+        while not self._closed:
+            try:
+                readable, _, _ = select.select([self._fd], [], [], 0.5)
+                if not readable:
+                    continue
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                logger.error(f"Download watcher stopped: {str(e)}")
+                break
+
+            names = []
+            rescan = False
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost; fall back to what is on disk right now.
+                    rescan = True
+                    names.extend(sorted(
+                        entry for entry in os.listdir(self.download_dir) if is_complete_pdf(entry)
+                    ))
+                elif mask & IN_IGNORED:
+                    logger.error(f"Download directory {self.download_dir} is no longer watched")
+                    self._closed = True
+                elif name and is_complete_pdf(name):
+                    names.append(name)
+
+            if names:
+                self._record(names, rescan)
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
@@ -0,0 +1,212 @@
+import os
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DRIVER_POOL_SIZE = int(os.environ.get("DRIVER_POOL_SIZE", "0"))
+DRIVER_MAX_USES = int(os.environ.get("DRIVER_MAX_USES", "20"))
+DRIVER_MAX_RSS_MB = int(os.environ.get("DRIVER_MAX_RSS_MB", "1024"))
+
+
+# Returns {pid: value in bytes} for `field` of pid and all its descendants.
+def _process_tree_field(pid, field):
+    children = {}
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/status') as f:
+                status = f.read()
+        except OSError:
+            continue
+        ppid = None
+        for line in status.splitlines():
+            if line.startswith('PPid:'):
+                ppid = int(line.split()[1])
+            elif line.startswith(field + ':'):
+                rss[int(entry)] = int(line.split()[1]) * 1024
+        if ppid is not None:
+            children.setdefault(ppid, []).append(int(entry))
+
+    tree = {}
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        tree[current] = rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+# VmRSS is the current resident memory; VmHWM is each process's peak since it started
+# or since its peak was last reset.
+def process_tree_rss(pid, field='VmRSS'):
+    if not os.path.isdir('/proc'):
+        return None
+    return sum(_process_tree_field(pid, field).values())
+
+
+# Writing 5 to clear_refs resets VmHWM to the current RSS (Linux 4.0+).
+def reset_process_tree_peak(pid):
+    if not os.path.isdir('/proc'):
+        return False
+    reset = True
+    for current in _process_tree_field(pid, 'VmHWM'):
+        try:
+            with open(f'/proc/{current}/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            reset = False
+    return reset
+
+
+def driver_rss(driver, field='VmRSS'):
+    try:
+        return process_tree_rss(driver.service.process.pid, field)
+    except Exception:
+        return None
+
+
+def reset_driver_peak(driver):
+    try:
+        return reset_process_tree_peak(driver.service.process.pid)
+    except Exception:
+        return False
+
+
+class PooledDriver:
+    def __init__(self, slot, driver, download_dir):
+        self.slot = slot
+        self.driver = driver
+        self.download_dir = download_dir
+        self.uses = 0
+        self.created = time.time()
+
+
+class DriverPool:
+    def __init__(self, size=DRIVER_POOL_SIZE, max_uses=DRIVER_MAX_USES, max_rss_mb=DRIVER_MAX_RSS_MB):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self._idle = []
+        self._free_slots = list(range(1, self.size + 1))
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def start(self):
+        threading.Thread(target=self._warm_up, name="driver-pool-warmup", daemon=True).start()
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._condition:
+                while not self._idle and not self._free_slots:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("No WebDriver available in pool")
+                    self._condition.wait(remaining)
+
+                if self._idle:
+                    pooled = self._idle.pop()
+                    slot = None
+                else:
+                    pooled = None
+                    slot = self._free_slots.pop(0)
+
+            if pooled is None:
+                pooled = self._create(slot)
+                if pooled is None:
+                    raise RuntimeError("Could not start a WebDriver for the pool")
+                return pooled
+
+            if self._is_healthy(pooled):
+                return pooled
+
+            logger.info(f"Pooled WebDriver {pooled.slot} failed health check, replacing it")
+            self._retire(pooled)
+
+    def release(self, pooled, healthy=True):
+        pooled.uses += 1
+
+        if not healthy or self._closed:
+            self._retire(pooled)
+            return
+
+        if pooled.uses >= self.max_uses:
+            logger.info(f"Recycling pooled WebDriver {pooled.slot} after {pooled.uses} uses")
+            self._retire(pooled)
+            return
+
+        rss = driver_rss(pooled.driver)
+        if rss is not None and rss > self.max_rss:
+            logger.info(f"Recycling pooled WebDriver {pooled.slot} using {rss // (1024 * 1024)} MB")
+            self._retire(pooled)
+            return
+
+        try:
+            pooled.driver.delete_all_cookies()
+            pooled.driver.get("about:blank")
+        except Exception:
+            self._retire(pooled)
+            return
+
+        with self._condition:
+            self._idle.append(pooled)
+            self._condition.notify()
+
+    def shutdown(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._retire(pooled)
+
+    def _warm_up(self):
+        while True:
+            with self._condition:
+                if self._closed or not self._free_slots or len(self._idle) >= self.size:
+                    return
+                slot = self._free_slots.pop(0)
+            pooled = self._create(slot)
+            if pooled is None:
+                return
+            with self._condition:
+                self._idle.append(pooled)
+                self._condition.notify()
+
+    def _create(self, slot):
+        # Imported here so that loading the pool settings does not pull in Selenium.
+        from scraper import PROCESS_DOWNLOAD_DIR, setup_driver
+
+        download_dir = os.path.join(PROCESS_DOWNLOAD_DIR, f"pool_{slot}")
+        try:
+            driver = setup_driver(download_dir)
+        except Exception as e:
+            logger.error(f"Failed to start pooled WebDriver {slot}: {str(e)}")
+            with self._condition:
+                self._free_slots.append(slot)
+                self._condition.notify()
+            return None
+        logger.info(f"Started pooled WebDriver {slot}")
+        return PooledDriver(slot, driver, download_dir)
+
+    def _is_healthy(self, pooled):
+        try:
+            pooled.driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    def _retire(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+        with self._condition:
+            self._free_slots.append(pooled.slot)
+            self._condition.notify()
+        if not self._closed:
+            self.start()
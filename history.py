@@ -0,0 +1,108 @@
+import re
+import threading
+from array import array
+from bisect import bisect_left
+
+from database import (
+    iter_history, iter_outbox_invoice_numbers, add_to_history_batch, get_invoice_by_content_hash, claim_invoice
+)
+from leases import INSTANCE_ID, INVOICE_CLAIM_TTL_SECONDS
+
+INVOICE_NR_PATTERN = re.compile(r'S-([1-9]\d{0,17})')
+
+
+def invoice_number_key(rechnungs_nr):
+    match = INVOICE_NR_PATTERN.fullmatch(rechnungs_nr)
+    return int(match.group(1)) if match else None
+
+
+# Canonical S-<digits> numbers are kept as a sorted array of 64-bit integers
+# (8 bytes per invoice); anything else falls back to a plain set.
+class HistoryIndex:
+    def __init__(self):
+        self._numbers = array('q')
+        self._others = set()
+        self._added = set()
+        self._queued = set()
+        self._contents = {}
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        numbers = []
+        for rechnungs_nr in iter_history():
+            key = invoice_number_key(rechnungs_nr)
+            if key is None:
+                index._others.add(rechnungs_nr)
+            else:
+                numbers.append(key)
+        numbers.sort()
+        index._numbers = array('q', numbers)
+        index._queued.update(iter_outbox_invoice_numbers())
+        return index
+
+    def __len__(self):
+        return len(self._numbers) + len(self._others) + len(self._added)
+
+    def __contains__(self, rechnungs_nr):
+        if rechnungs_nr in self._added or rechnungs_nr in self._queued:
+            return True
+        key = invoice_number_key(rechnungs_nr)
+        if key is None:
+            return rechnungs_nr in self._others
+        position = bisect_left(self._numbers, key)
+        return position < len(self._numbers) and self._numbers[position] == key
+
+    def add(self, rechnungs_nr, content_hash=None):
+        with self._lock:
+            if rechnungs_nr in self:
+                return
+            self._added.add(rechnungs_nr)
+            self._pending.append((rechnungs_nr, content_hash))
+
+    # Reserves an invoice in the shared database before it is downloaded, so other
+    # bot instances skip it. Returns False if it is already handled elsewhere.
+    def claim(self, rechnungs_nr):
+        status = claim_invoice(rechnungs_nr, INSTANCE_ID, INVOICE_CLAIM_TTL_SECONDS)
+        if status == 'claimed':
+            return True
+        if status != 'taken':
+            with self._lock:
+                (self._added if status == 'processed' else self._queued).add(rechnungs_nr)
+        return False
+
+    # Reserves a content hash for an invoice that is about to be delivered.
+    # Returns the invoice number that already owns identical content, if any.
+    def claim_content(self, content_hash, rechnungs_nr):
+        with self._lock:
+            owner = self._contents.get(content_hash)
+            if owner is None:
+                owner = get_invoice_by_content_hash(content_hash)
+            if owner is not None and owner != rechnungs_nr:
+                return owner
+            self._contents[content_hash] = rechnungs_nr
+            return None
+
+    def release_content(self, content_hash, rechnungs_nr):
+        with self._lock:
+            if self._contents.get(content_hash) == rechnungs_nr:
+                del self._contents[content_hash]
+
+    def mark_queued(self, rechnungs_nr):
+        with self._lock:
+            self._queued.add(rechnungs_nr)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        try:
+            add_to_history_batch(pending)
+        except Exception:
+            with self._lock:
+                self._pending = pending + self._pending
+            raise
+        return len(pending)
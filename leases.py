@@ -0,0 +1,88 @@
+import os
+import time
+import socket
+import logging
+import threading
+
+from database import claim_account, renew_account_leases, release_account_leases, get_account_leases, touch_run
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_ID = os.environ.get("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+ACCOUNT_LEASE_TTL_SECONDS = int(os.environ.get("ACCOUNT_LEASE_TTL_SECONDS", "120"))
+INVOICE_CLAIM_TTL_SECONDS = int(os.environ.get("INVOICE_CLAIM_TTL_SECONDS", "900"))
+
+
+# Accounts are leased in the shared database while a worker processes them, one
+# login group at a time, so that several bot instances split the account list as
+# they go. A heartbeat keeps the leases alive; when an instance dies they expire
+# and another one takes over. The same heartbeat marks the run itself as alive,
+# so other instances do not resume it.
+class AccountLeases:
+    def __init__(self, owner=INSTANCE_ID, ttl=ACCOUNT_LEASE_TTL_SECONDS, run_id=None):
+        self.owner = owner
+        self.ttl = ttl
+        self.run_id = run_id
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._heartbeat, name="account-lease-heartbeat", daemon=True)
+                self._thread.start()
+
+    def claim(self, accounts):
+        claimed = [account for account in accounts if claim_account(account['id'], self.owner, self.ttl)]
+        with self._lock:
+            self._held.update(account['id'] for account in claimed)
+        if claimed:
+            self.start()
+        return claimed
+
+    def held_elsewhere(self):
+        now = time.time()
+        return {
+            row['account_id'] for row in get_account_leases()
+            if row['owner'] != self.owner and row['expires_at'] >= now
+        }
+
+    def release(self, accounts=None):
+        if accounts is None:
+            self._stop.set()
+            if self._thread:
+                self._thread.join()
+                self._thread = None
+        with self._lock:
+            if accounts is None:
+                account_ids = set(self._held)
+            else:
+                account_ids = {account['id'] for account in accounts} & self._held
+            self._held -= account_ids
+        if account_ids:
+            try:
+                release_account_leases(self.owner, list(account_ids))
+            except Exception as e:
+                logger.error(f"Could not release account leases: {str(e)}")
+
+    def _heartbeat(self):
+        while not self._stop.wait(max(1.0, self.ttl / 4)):
+            if self.run_id:
+                try:
+                    touch_run(self.run_id, self.owner)
+                except Exception as e:
+                    logger.error(f"Could not renew run heartbeat: {str(e)}")
+            with self._lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                renewed = renew_account_leases(self.owner, held, self.ttl)
+            except Exception as e:
+                logger.error(f"Could not renew account leases: {str(e)}")
+                continue
+            if renewed < len(held):
+                logger.error(f"Lost {len(held) - renewed} account lease(s) to another instance")
+
@@ -0,0 +1,231 @@
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from database import add_logs_batch, get_logs, get_logs_after, get_max_log_id, clear_logs, query_logs, prune_logs
+
+BUFFER_SIZE = 1000
+FLUSH_BATCH_SIZE = 50
+FLUSH_INTERVAL_SECONDS = 2.0
+LIVE_FLUSH_INTERVAL_SECONDS = 0.2
+IGNORED_LOGGERS = ("werkzeug",)
+
+LOG_RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", "30"))
+LOG_MAX_ROWS = int(os.environ.get("LOG_MAX_ROWS", "50000"))
+PRUNE_INTERVAL_SECONDS = 60
+PRUNE_BATCH_SIZE = 1000
+
+_context = threading.local()
+
+
+def get_log_context():
+    return getattr(_context, 'run_id', None), getattr(_context, 'account_id', None)
+
+
+@contextmanager
+def log_context(run_id=None, account_id=None):
+    previous = get_log_context()
+    _context.run_id = run_id if run_id is not None else previous[0]
+    _context.account_id = account_id if account_id is not None else previous[1]
+    try:
+        yield
+    finally:
+        _context.run_id, _context.account_id = previous
+
+
+class LogSink:
+    def __init__(self, buffer_size=BUFFER_SIZE, batch_size=FLUSH_BATCH_SIZE, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=buffer_size)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._last_id = 0
+        self._listeners = 0
+        self._writer = None
+        self._last_prune = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._writer is not None:
+                return
+            rows = get_logs(limit=self._buffer.maxlen)
+            self._buffer.extend(dict(row) for row in reversed(rows))
+            self._last_id = get_max_log_id()
+            self._writer = threading.Thread(target=self._run, name="log-sink-writer", daemon=True)
+            self._writer.start()
+        atexit.register(self.flush)
+
+    # Ids are assigned by SQLite when a batch is written, so several processes can
+    # share the logs table. The buffer mirrors the tail of the table: after each
+    # write the writer reads back every new row, including those of other processes.
+    def emit(self, level, message, timestamp=None, run_id=None, account_id=None):
+        if self._writer is None:
+            self.start()
+        with self._lock:
+            record = {
+                'id': None,
+                'timestamp': timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'level': level,
+                'message': message,
+                'run_id': run_id,
+                'account_id': account_id,
+            }
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+        return record
+
+    def last_id(self):
+        with self._lock:
+            return self._buffer[-1]['id'] if self._buffer else self._last_id
+
+    def wait_for_records(self, since_id, timeout=None):
+        with self._changed:
+            if not self._buffer or self._buffer[-1]['id'] <= since_id:
+                self._listeners += 1
+                # Switch the writer to the short live interval right away.
+                if self._listeners == 1:
+                    self._wakeup.set()
+                try:
+                    self._changed.wait(timeout)
+                finally:
+                    self._listeners -= 1
+            return [record for record in self._buffer if record['id'] > since_id]
+
+    def notify_listeners(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def recent(self, limit=100):
+        self.flush()
+        with self._lock:
+            records = list(self._buffer)[-limit:]
+        records.reverse()
+        return records
+
+    def query(self, since_id=None, before_id=None, level=None, account_id=None, run_id=None, limit=100):
+        self.flush()
+        with self._lock:
+            buffered = list(self._buffer)
+        
+        matches = [
+            record for record in buffered
+            if (since_id is None or record['id'] > since_id)
+            and (before_id is None or record['id'] < before_id)
+            and (not level or record['level'] == level)
+            and (account_id is None or record['account_id'] == account_id)
+            and (not run_id or record['run_id'] == run_id)
+        ]
+        
+        forward = since_id is not None and before_id is None
+        if forward:
+            complete = bool(buffered) and since_id >= buffered[0]['id'] - 1
+        else:
+            complete = len(matches) >= limit
+        
+        if complete:
+            matches = matches[:limit] if forward else matches[-limit:]
+            matches.reverse()
+            return matches
+        
+        return [dict(row) for row in query_logs(since_id, before_id, level, account_id, run_id, limit)]
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending:
+                try:
+                    add_logs_batch([
+                        (record['timestamp'], record['level'], record['message'], record['run_id'], record['account_id'])
+                        for record in pending
+                    ])
+                except Exception as e:
+                    sys.stderr.write(f"Failed to write {len(pending)} log records: {e}\n")
+            self._pull()
+
+    def _pull(self):
+        while True:
+            try:
+                rows = get_logs_after(self._last_id, self._buffer.maxlen)
+            except Exception as e:
+                sys.stderr.write(f"Failed to read new log records: {e}\n")
+                return
+            if not rows:
+                return
+            with self._lock:
+                self._buffer.extend(dict(row) for row in rows)
+                self._last_id = rows[-1]['id']
+                self._changed.notify_all()
+            if len(rows) < self._buffer.maxlen:
+                return
+
+    def clear(self):
+        with self._flush_lock:
+            with self._lock:
+                self._buffer.clear()
+                self._pending = []
+            clear_logs()
+
+    def prune(self):
+        try:
+            return prune_logs(LOG_RETENTION_DAYS, LOG_MAX_ROWS, PRUNE_BATCH_SIZE)
+        except Exception as e:
+            sys.stderr.write(f"Failed to prune logs: {e}\n")
+            return 0
+
+    def _run(self):
+        while True:
+            # With live listeners, batches are flushed on a short timer instead of per record.
+            self._wakeup.wait(LIVE_FLUSH_INTERVAL_SECONDS if self._listeners else self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if time.monotonic() - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+                self._last_prune = time.monotonic()
+                self.prune()
+
+
+class SinkHandler(logging.Handler):
+    def __init__(self, sink, level=logging.INFO):
+        super().__init__(level)
+        self.sink = sink
+
+    def filter(self, record):
+        if record.name.split('.')[0] in IGNORED_LOGGERS:
+            return False
+        return super().filter(record)
+
+    def emit(self, record):
+        try:
+            run_id, account_id = get_log_context()
+            self.sink.emit(
+                record.levelname,
+                self.format(record),
+                run_id=getattr(record, 'run_id', run_id),
+                account_id=getattr(record, 'account_id', account_id)
+            )
+        except Exception:
+            self.handleError(record)
+
+
+log_sink = LogSink()
+
+
+def setup_logging(level=logging.INFO):
+    root = logging.getLogger()
+    if any(isinstance(handler, SinkHandler) for handler in root.handlers):
+        return log_sink
+    root.setLevel(level)
+    root.addHandler(SinkHandler(log_sink, level))
+    log_sink.start()
+    return log_sink
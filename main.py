@@ -1,26 +1,37 @@
-import threading
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-from database import init_db, add_account, get_all_accounts, delete_account, get_logs, clear_logs
-from scraper import run_scraper
+import json
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify
+from database import (
+    init_db, add_account, get_all_accounts, delete_account, get_recent_runs, get_run, get_run_metrics,
+    get_metric_trend, get_outbox_count
+)
+from log_sink import log_sink, setup_logging
+from driver_pool import DriverPool, DRIVER_POOL_SIZE
+from scheduler import Scheduler
+import metrics
 
 app = Flask(__name__)
 
-bot_running = False
-bot_lock = threading.Lock()
+MAX_LOGS_PAGE_SIZE = 500
+SSE_KEEPALIVE_SECONDS = 15
 
-def run_bot_thread():
-    global bot_running
-    try:
-        run_scraper()
-    finally:
-        with bot_lock:
-            bot_running = False
+driver_pool = None
+
+def run_bot(account_ids, trigger, run_id=None):
+    # Selenium is only loaded once the first run starts, so the dashboard starts quickly.
+    from scraper import run_scraper
+    run_scraper(run_id=run_id, driver_pool=driver_pool, account_ids=account_ids, trigger=trigger)
+
+scheduler = Scheduler(run_bot, on_change=log_sink.notify_listeners)
+
+def bot_status():
+    return {'running': scheduler.running, 'queued': scheduler.queued}
 
 @app.route('/')
 def index():
     accounts = get_all_accounts()
-    logs = get_logs(limit=100)
-    return render_template('index.html', accounts=accounts, logs=logs, bot_running=bot_running)
+    logs = log_sink.recent(limit=100)
+    last_log_id = logs[0]['id'] if logs else log_sink.last_id()
+    return render_template('index.html', accounts=accounts, logs=logs, last_log_id=last_log_id, bot_running=scheduler.running)
 
 @app.route('/add', methods=['POST'])
 def add():
@@ -30,6 +41,7 @@ def add():
     password = request.form.get('password', '').strip()
     api_key = request.form.get('api_key', '').strip()
     save_path = request.form.get('save_path', '').strip()
+    interval = request.form.get('interval', type=int)
     
     if name and username and password and (api_key or save_path):
         add_account(
@@ -38,7 +50,8 @@ def add():
             username, 
             password, 
             api_key if api_key else None,
-            save_path if save_path else None
+            save_path if save_path else None,
+            interval if interval and interval > 0 else None
         )
     
     return redirect(url_for('index'))
@@ -50,32 +63,100 @@ def delete(account_id):
 
 @app.route('/run', methods=['POST'])
 def run():
-    global bot_running
-    
-    with bot_lock:
-        if bot_running:
-            return jsonify({'status': 'error', 'message': 'Bot is already running'})
-        bot_running = True
+    was_running = scheduler.running
+    position = scheduler.request_run(trigger='manual')
     
-    thread = threading.Thread(target=run_bot_thread, daemon=True)
-    thread.start()
-    
-    return jsonify({'status': 'success', 'message': 'Bot started'})
+    if was_running or position > 1:
+        return jsonify({'status': 'queued', 'message': f'Run queued (position {position})', 'position': position})
+    return jsonify({'status': 'success', 'message': 'Bot started', 'position': position})
 
 @app.route('/logs')
 def logs():
-    logs = get_logs(limit=100)
-    return jsonify([dict(log) for log in logs])
+    level = request.args.get('level', '').strip().upper() or None
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_LOGS_PAGE_SIZE)
+    
+    return jsonify(log_sink.query(
+        since_id=request.args.get('since_id', type=int),
+        before_id=request.args.get('before_id', type=int),
+        level=level,
+        account_id=request.args.get('account_id', type=int),
+        run_id=request.args.get('run_id') or None,
+        limit=limit
+    ))
+
+@app.route('/events')
+def events():
+    # On a reconnect the browser sends the last id it received; the since_id in the
+    # URL is only the starting point from when the page was rendered.
+    since_id = request.headers.get('Last-Event-ID', type=int)
+    if since_id is None:
+        since_id = request.args.get('since_id', type=int)
+    if since_id is None:
+        since_id = log_sink.last_id()
+    
+    def stream(last_id):
+        last_status = None
+        yield "retry: 3000\n\n"
+        
+        while True:
+            current_status = bot_status()
+            if current_status != last_status:
+                last_status = current_status
+                yield f"event: status\ndata: {json.dumps(last_status)}\n\n"
+            
+            records = log_sink.wait_for_records(last_id, timeout=SSE_KEEPALIVE_SECONDS)
+            for record in records:
+                yield f"id: {record['id']}\nevent: log\ndata: {json.dumps(record)}\n\n"
+            if records:
+                last_id = records[-1]['id']
+            elif bot_status() == last_status:
+                yield ": keepalive\n\n"
+    
+    return Response(
+        stream(since_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/clear_logs', methods=['POST'])
 def clear():
-    clear_logs()
+    log_sink.clear()
     return redirect(url_for('index'))
 
 @app.route('/status')
 def status():
-    return jsonify({'running': bot_running})
+    return jsonify(bot_status())
+
+@app.route('/runs')
+def runs():
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return jsonify([dict(row) for row in get_recent_runs(limit)])
+
+@app.route('/runs/<run_id>')
+def run_details(run_id):
+    run = get_run(run_id)
+    if run is None:
+        return jsonify({'status': 'error', 'message': 'Unknown run'}), 404
+    return jsonify(dict(run, metrics=[dict(row) for row in get_run_metrics(run_id)]))
+
+@app.route('/runs/trend')
+def runs_trend():
+    name = request.args.get('metric', 'run_duration')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return jsonify([dict(row) for row in get_metric_trend(name, request.args.get('account_id', type=int), limit)])
+
+@app.route('/metrics')
+def metrics_endpoint():
+    metrics.set_gauge('mareon_scheduler_running', int(scheduler.running))
+    metrics.set_gauge('mareon_scheduler_queued', scheduler.queued)
+    metrics.set_gauge('mareon_outbox_size', get_outbox_count())
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     init_db()
-    app.run(host='0.0.0.0', port=8080, debug=False)
+    setup_logging()
+    if DRIVER_POOL_SIZE > 0:
+        driver_pool = DriverPool(DRIVER_POOL_SIZE)
+        driver_pool.start()
+    scheduler.start()
+    app.run(host='0.0.0.0', port=8080, debug=False, threaded=True)
@@ -0,0 +1,125 @@
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+HELP = {
+    'mareon_step_duration_seconds': "Time spent in a scraper step",
+    'mareon_download_wait_seconds': "Time spent waiting for a browser download to finish",
+    'butler_upload_duration_seconds': "Time spent uploading one invoice to Buchhaltungsbutler, including retries",
+    'mareon_invoices_total': "Invoices seen by the scraper, by result",
+    'mareon_runs_total': "Finished scraper runs, by status",
+    'mareon_run_duration_seconds': "Duration of a whole scraper run",
+    'mareon_driver_restarts_total': "WebDrivers restarted after crashing during a run",
+    'mareon_page_load_seconds': "Navigation timing of Mareon pages (start to load event)",
+    'mareon_driver_peak_rss_bytes': (
+        "Sum of the per-process peak resident memory (VmHWM) of the WebDriver process tree during an account; "
+        "processes peak at different times, so this is an upper bound of the tree's peak"
+    ),
+    'mareon_scheduler_running': "Whether a scraper run is currently executing",
+    'mareon_scheduler_queued': "Number of queued scraper runs",
+    'mareon_outbox_size': "Invoices waiting in the outbox for a delivery retry",
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(DEFAULT_BUCKETS), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in _histograms.items()}
+
+    lines = []
+    written = set()
+
+    def header(name, kind):
+        if name not in written:
+            written.add(name)
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, 'counter')
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, 'gauge')
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), histogram in sorted(histograms.items()):
+        header(name, 'histogram')
+        for bound, count in zip(DEFAULT_BUCKETS, histogram['buckets']):
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram['sum'])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,174 @@
+import os
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+
+from database import get_all_accounts, get_interrupted_runs
+from leases import INSTANCE_ID, ACCOUNT_LEASE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER", "1") != "0"
+SCHEDULER_TICK_SECONDS = int(os.environ.get("SCHEDULER_TICK_SECONDS", "30"))
+SCHEDULER_JITTER_FRACTION = float(os.environ.get("SCHEDULER_JITTER_FRACTION", "0.1"))
+
+
+class RunRequest:
+    def __init__(self, account_ids, trigger, run_id=None):
+        self.account_ids = None if account_ids is None else set(account_ids)
+        self.trigger = trigger
+        self.run_id = run_id
+
+    def merge(self, other):
+        if self.account_ids is None or other.account_ids is None:
+            self.account_ids = None
+        else:
+            self.account_ids |= other.account_ids
+
+
+class Scheduler:
+    def __init__(self, run_callback, on_change=None, tick_seconds=SCHEDULER_TICK_SECONDS,
+                 jitter_fraction=SCHEDULER_JITTER_FRACTION, enabled=SCHEDULER_ENABLED):
+        self.run_callback = run_callback
+        self.on_change = on_change
+        self.tick_seconds = tick_seconds
+        self.jitter_fraction = jitter_fraction
+        self.enabled = enabled
+        self.running = False
+        self._pending = []
+        self._next_due = {}
+        self._last_attempt = {}
+        self._last_full_attempt = 0.0
+        self._resumed = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+            self._thread.start()
+
+    @property
+    def queued(self):
+        with self._condition:
+            return len(self._pending)
+
+    def request_run(self, account_ids=None, trigger='manual', run_id=None):
+        request = RunRequest(account_ids, trigger, run_id)
+
+        with self._condition:
+            # Requests of the same kind collapse into one queued run instead of piling up.
+            for pending in self._pending:
+                if pending.trigger == trigger and pending.run_id is None and run_id is None:
+                    pending.merge(request)
+                    position = self._pending.index(pending) + 1
+                    break
+            else:
+                self._pending.append(request)
+                position = len(self._pending)
+            self._condition.notify_all()
+
+        self._changed()
+        return position
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def _run(self):
+        self._enqueue_interrupted_runs()
+        while True:
+            with self._condition:
+                if not self._pending:
+                    self._condition.wait(self.tick_seconds)
+                request = self._pending.pop(0) if self._pending else None
+                if request:
+                    self.running = True
+
+            if request is None:
+                self._enqueue_interrupted_runs()
+                if self.enabled:
+                    self._enqueue_due_accounts()
+                continue
+
+            self._changed()
+            try:
+                self.run_callback(request.account_ids, request.trigger, request.run_id)
+            except Exception as e:
+                logger.error(f"Scheduled run failed: {str(e)}")
+            finally:
+                with self._condition:
+                    self.running = False
+                # Accounts another instance held during the run keep their old last_run_at;
+                # the attempt time keeps them from being queued again on every tick.
+                attempted_at = time.time()
+                if request.account_ids is None:
+                    self._last_full_attempt = attempted_at
+                    self._next_due.clear()
+                else:
+                    for account_id in request.account_ids:
+                        self._last_attempt[account_id] = attempted_at
+                        self._next_due.pop(account_id, None)
+                self._changed()
+
+    # Runs left `running` by a stopped instance are resumed once their heartbeat is
+    # stale, which also covers this instance's own runs from before a restart.
+    def _enqueue_interrupted_runs(self):
+        try:
+            runs = get_interrupted_runs(INSTANCE_ID, ACCOUNT_LEASE_TTL_SECONDS)
+        except Exception as e:
+            logger.error(f"Scheduler could not load interrupted runs: {str(e)}")
+            return
+
+        for run in runs:
+            if run['run_id'] in self._resumed:
+                continue
+            self._resumed.add(run['run_id'])
+            logger.info(f"Queueing interrupted run {run['run_id']} to resume it")
+            self.request_run(trigger='resume', run_id=run['run_id'])
+
+    def _enqueue_due_accounts(self):
+        try:
+            accounts = get_all_accounts()
+        except Exception as e:
+            logger.error(f"Scheduler could not load accounts: {str(e)}")
+            return
+
+        now = time.time()
+        due = []
+        known_ids = set()
+
+        for account in accounts:
+            interval = account['interval_minutes']
+            if not interval:
+                continue
+            known_ids.add(account['id'])
+
+            next_due = self._next_due.get(account['id'])
+            if next_due is None:
+                attempted_at = max(self._last_attempt.get(account['id'], 0.0), self._last_full_attempt)
+                next_due = self._compute_next_due(account['last_run_at'], interval * 60, attempted_at)
+                self._next_due[account['id']] = next_due
+            if next_due <= now:
+                due.append(account['id'])
+
+        for account_id in list(self._next_due):
+            if account_id not in known_ids:
+                del self._next_due[account_id]
+                self._last_attempt.pop(account_id, None)
+
+        if due:
+            logger.info(f"Scheduling run for {len(due)} due account(s)")
+            self.request_run(due, trigger='schedule')
+            for account_id in due:
+                self._next_due[account_id] = float('inf')
+
+    def _compute_next_due(self, last_run_at, interval_seconds, attempted_at=0.0):
+        jitter = random.uniform(0, interval_seconds * self.jitter_fraction)
+        last_run = datetime.strptime(last_run_at, "%Y-%m-%d %H:%M:%S").timestamp() if last_run_at else 0.0
+        last_run = max(last_run, attempted_at)
+        if not last_run:
+            return time.time() + jitter
+        return last_run + interval_seconds + jitter
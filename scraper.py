@@ -2,21 +2,186 @@ import os
 import time
 import glob
 import re
+import shutil
+import socket
+import logging
+import queue
+import threading
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 
-from database import get_all_accounts, is_invoice_processed, add_to_history, add_log
-from butler_api import upload_invoice
+from database import (
+    get_all_accounts, get_account, get_high_water_mark, set_high_water_mark, start_run, finish_run,
+    set_account_last_run, add_run_metrics, get_run, add_run_accounts, get_run_accounts, get_run_account,
+    set_run_account_page, finish_run_account, release_invoice_claims, take_over_run
+)
+from history import HistoryIndex, invoice_number_key
+from delivery import DeliveryPipeline, drain_outbox
+from log_sink import log_context
+from session_cache import load_cookies, save_cookies, discard_cookies
+from download_watcher import DownloadWatcher
+from leases import AccountLeases, INSTANCE_ID, ACCOUNT_LEASE_TTL_SECONDS
+import metrics
+
+logger = logging.getLogger(__name__)
 
 DOWNLOAD_DIR = os.path.abspath("downloads")
-LOGIN_URL = "https://www.mareon.com/login"
-INVOICES_URL = "https://www.mareon.com/portal/rechnungen"
+# Each process (web app, replicas, cli.py) downloads into its own folder, so cleaning
+# up leftovers never touches files another process is still delivering.
+PROCESS_DOWNLOAD_PREFIX = f"{socket.gethostname()}-"
+PROCESS_DOWNLOAD_DIR = os.path.join(DOWNLOAD_DIR, f"{PROCESS_DOWNLOAD_PREFIX}{os.getpid()}")
+BASE_URL = os.environ.get("MAREON_BASE_URL", "https://www.mareon.com/").rstrip("/") + "/"
+LOGIN_URL = urljoin(BASE_URL, "login")
+INVOICES_URL = urljoin(BASE_URL, "portal/rechnungen")
+MAX_WORKERS = int(os.environ.get("SCRAPER_MAX_WORKERS", "1"))
+MAX_INVOICE_PAGES = int(os.environ.get("SCRAPER_MAX_PAGES", "100"))
+DIRECT_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30
+DRIVER_POOL_ACQUIRE_TIMEOUT = 300
+MAX_DRIVER_RESTARTS = int(os.environ.get("SCRAPER_MAX_DRIVER_RESTARTS", "2"))
+BROWSER_LEAN = os.environ.get("BROWSER_LEAN", "0") == "1"
+BROWSER_LEAN_HEAP_MB = int(os.environ.get("BROWSER_LEAN_HEAP_MB", "256"))
+BROWSER_LEAN_CACHE_MB = int(os.environ.get("BROWSER_LEAN_CACHE_MB", "8"))
+
+# Resources the scraper never looks at; blocked through DevTools in lean mode.
+# Stylesheets stay enabled because the mandant dropdown and the visibility
+# checks depend on them.
+LEAN_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.bmp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3", "*.ogg",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*facebook.net*",
+    "*hotjar.com*", "*matomo*", "*piwik*", "*etracker*", "*usercentrics*", "*cookiebot*",
+]
+LEAN_CHROME_ARGUMENTS = [
+    f"--disk-cache-size={BROWSER_LEAN_CACHE_MB * 1024 * 1024}",
+    f"--media-cache-size={BROWSER_LEAN_CACHE_MB * 1024 * 1024}",
+    f"--js-flags=--max-old-space-size={BROWSER_LEAN_HEAP_MB}",
+    "--renderer-process-limit=1",
+    "--blink-settings=imagesEnabled=false",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-features=Translate,MediaRouter,OptimizationHints",
+    "--mute-audio",
+    "--no-first-run",
+]
+
+_chromedriver_path = None
+
+INVOICE_NR_PATTERN = re.compile(r'S-\d+')
+INVOICE_DATE_PATTERN = re.compile(r'\b\d{2}\.\d{2}\.\d{4}\b')
+INVOICE_AMOUNT_PATTERN = re.compile(r'-?\d{1,3}(?:\.\d{3})*,\d{2}')
+
+INVOICE_ROWS_SCRIPT = """
+return Array.from(document.querySelectorAll('tbody tr')).map(function (row, index) {
+    var link = row.querySelector('a[title="Rechnungsdruck"]');
+    if (!link) {
+        link = Array.from(row.querySelectorAll('a[title]')).find(function (a) {
+            return a.getAttribute('title').indexOf('Rechnung') !== -1;
+        }) || null;
+    }
+    return {
+        index: index,
+        text: row.innerText || '',
+        link: link,
+        href: link ? link.getAttribute('href') : null,
+        onclick: link ? link.getAttribute('onclick') : null
+    };
+});
+"""
+
+NEXT_PAGE_SCRIPT = """
+var next = document.querySelector('.ui-paginator-next, a[rel="next"], li.next > a, a.next');
+if (!next || next.classList.contains('ui-state-disabled') || next.classList.contains('disabled')
+        || (next.parentElement && next.parentElement.classList.contains('disabled'))
+        || next.getAttribute('aria-disabled') === 'true') {
+    return false;
+}
+next.click();
+return true;
+"""
+
+FIRST_ROW_TEXT_SCRIPT = """
+var rows = document.querySelectorAll('tbody tr');
+for (var i = 0; i < rows.length; i++) {
+    var match = (rows[i].innerText || '').match(/S-\\d+/);
+    if (match) { return match[0]; }
+}
+return null;
+"""
+
+PAGE_LOAD_SCRIPT = """
+var entry = performance.getEntriesByType('navigation')[0];
+if (!entry) { return null; }
+return (entry.loadEventEnd || entry.domContentLoadedEventEnd || entry.responseEnd) - entry.startTime;
+"""
+
+AJAX_IDLE_SCRIPT = """
+if (document.readyState !== 'complete') { return false; }
+if (window.jQuery && window.jQuery.active > 0) { return false; }
+if (window.PrimeFaces && PrimeFaces.ajax && PrimeFaces.ajax.Queue
+        && !PrimeFaces.ajax.Queue.isEmpty()) { return false; }
+return true;
+"""
+
+@contextmanager
+def timed(timings, step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('mareon_step_duration_seconds', elapsed, step=step)
+        if timings is not None:
+            timings[step] = timings.get(step, 0.0) + elapsed
+
+def format_timings(timings):
+    return ", ".join(f"{step}={seconds:.2f}s" for step, seconds in timings.items())
+
+def is_ajax_idle(driver):
+    try:
+        return bool(driver.execute_script(AJAX_IDLE_SCRIPT))
+    except WebDriverException:
+        return False
+
+def wait_for_ajax_idle(driver, timeout=10):
+    WebDriverWait(driver, timeout, poll_frequency=0.1).until(is_ajax_idle)
+
+def measure_page_load(driver, timings, page):
+    try:
+        milliseconds = driver.execute_script(PAGE_LOAD_SCRIPT)
+    except WebDriverException:
+        return None
+    if not milliseconds:
+        return None
+    seconds = milliseconds / 1000.0
+    metrics.observe('mareon_page_load_seconds', seconds, page=page)
+    if timings is not None:
+        timings['page_load'] = timings.get('page_load', 0.0) + seconds
+    return seconds
+
+def reset_driver_peak_rss(driver):
+    from driver_pool import reset_driver_peak
+    if not reset_driver_peak(driver):
+        logger.debug("Could not reset the browser's peak memory, it covers earlier accounts too")
+
+def driver_peak_rss_mb(driver):
+    from driver_pool import driver_rss
+    rss = driver_rss(driver, 'VmHWM')
+    return None if rss is None else rss / (1024 * 1024)
 
 def save_debug_screenshot(driver, prefix="error"):
     try:
@@ -24,31 +189,36 @@ def save_debug_screenshot(driver, prefix="error"):
         filename = f"{prefix}_{timestamp}.png"
         filepath = os.path.join(DOWNLOAD_DIR, filename)
         driver.save_screenshot(filepath)
-        add_log("INFO", f"Debug screenshot saved: {filename}")
+        logger.info(f"Debug screenshot saved: {filename}")
         return filepath
     except Exception as e:
-        add_log("ERROR", f"Failed to save debug screenshot: {str(e)}")
+        logger.error(f"Failed to save debug screenshot: {str(e)}")
         return None
 
-def setup_driver():
-    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+def setup_driver(download_dir=DOWNLOAD_DIR, lean=BROWSER_LEAN):
+    os.makedirs(download_dir, exist_ok=True)
     
     chrome_options = Options()
     chrome_options.add_argument("--headless=new")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--window-size=1920,1080")
+    chrome_options.add_argument("--window-size=1280,800" if lean else "--window-size=1920,1080")
     chrome_options.add_argument("--disable-extensions")
     chrome_options.add_argument("--disable-popup-blocking")
+    if lean:
+        for argument in LEAN_CHROME_ARGUMENTS:
+            chrome_options.add_argument(argument)
     
     prefs = {
-        "download.default_directory": DOWNLOAD_DIR,
+        "download.default_directory": download_dir,
         "download.prompt_for_download": False,
         "download.directory_upgrade": True,
         "plugins.always_open_pdf_externally": True,
         "safebrowsing.enabled": True
     }
+    if lean:
+        prefs["profile.managed_default_content_settings.images"] = 2
     chrome_options.add_experimental_option("prefs", prefs)
     
     chrome_bin = os.environ.get("CHROME_BIN")
@@ -62,15 +232,23 @@ def setup_driver():
         "/nix/store/chromium-chromedriver/bin/chromedriver",
     ]
     
+    global _chromedriver_path
     driver = None
     last_error = None
     
-    for path in chromedriver_paths:
+    if _chromedriver_path:
+        try:
+            driver = webdriver.Chrome(service=Service(_chromedriver_path), options=chrome_options)
+        except Exception as e:
+            logger.info(f"Cached chromedriver {_chromedriver_path} failed, probing again: {str(e)}")
+            _chromedriver_path = None
+    
+    for path in chromedriver_paths if driver is None else []:
         if path and os.path.exists(path):
             try:
                 service = Service(path)
                 driver = webdriver.Chrome(service=service, options=chrome_options)
-                add_log("INFO", f"Using chromedriver at: {path}")
+                logger.info(f"Using chromedriver at: {path}")
                 break
             except Exception as e:
                 last_error = e
@@ -80,30 +258,44 @@ def setup_driver():
         try:
             service = Service()
             driver = webdriver.Chrome(service=service, options=chrome_options)
-            add_log("INFO", "Using system default chromedriver")
+            logger.info("Using system default chromedriver")
         except Exception:
             try:
                 from webdriver_manager.chrome import ChromeDriverManager
                 service = Service(ChromeDriverManager().install())
                 driver = webdriver.Chrome(service=service, options=chrome_options)
-                add_log("INFO", "Using webdriver-manager chromedriver")
+                logger.info("Using webdriver-manager chromedriver")
             except Exception as e:
-                add_log("ERROR", f"Failed to initialize WebDriver: {str(e)}")
+                logger.error(f"Failed to initialize WebDriver: {str(e)}")
                 raise
     
+    if _chromedriver_path is None:
+        _chromedriver_path = driver.service.path
+    
+    if lean:
+        apply_lean_profile(driver)
+    
     driver.implicitly_wait(10)
     return driver
 
-def login(driver, username, password):
-    add_log("INFO", f"Attempting login for user: {username}")
+def apply_lean_profile(driver):
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URLS})
+        logger.info(f"Lean browser mode: blocking {len(LEAN_BLOCKED_URLS)} resource patterns")
+    except Exception as e:
+        logger.error(f"Could not enable request blocking for lean browser mode: {str(e)}")
+
+def login(driver, username, password, timings=None):
+    logger.info(f"Attempting login for user: {username}")
     
     try:
         driver.get(LOGIN_URL)
-        time.sleep(2)
         
         username_field = WebDriverWait(driver, 10).until(
             EC.presence_of_element_located((By.ID, "modlgn_username"))
         )
+        measure_page_load(driver, timings, 'login')
         username_field.clear()
         username_field.send_keys(username)
         
@@ -112,34 +304,82 @@ def login(driver, username, password):
         password_field.send_keys(password)
         
         submit_button = driver.find_element(By.NAME, "Submit")
+        login_page_url = driver.current_url
         submit_button.click()
         
-        time.sleep(3)
+        WebDriverWait(driver, 15, poll_frequency=0.1).until(EC.any_of(
+            EC.staleness_of(submit_button),
+            EC.url_changes(login_page_url)
+        ))
+        wait_for_ajax_idle(driver)
         
         if "login" not in driver.current_url.lower():
-            add_log("INFO", f"Successfully logged in as: {username}")
+            logger.info(f"Successfully logged in as: {username}")
             return True
         else:
-            add_log("ERROR", f"Login failed for user: {username}")
+            logger.error(f"Login failed for user: {username}")
             return False
             
     except TimeoutException:
-        add_log("ERROR", f"Timeout during login for user: {username}")
+        logger.error(f"Timeout during login for user: {username}")
         save_debug_screenshot(driver, "error_login_timeout")
         return False
     except Exception as e:
-        add_log("ERROR", f"Login error for {username}: {str(e)}")
+        logger.error(f"Login error for {username}: {str(e)}")
         save_debug_screenshot(driver, "error_login")
         return False
 
+def restore_session(driver, username, require_default_mandant=False):
+    cached = load_cookies(username)
+    if not cached or not cached[0]:
+        return False
+    cookies, default_mandant = cached
+    if require_default_mandant and not default_mandant:
+        logger.info(f"Cached session for {username} has another mandant selected, logging in again")
+        return False
+    
+    try:
+        driver.get(BASE_URL)
+        driver.delete_all_cookies()
+        for cookie in cookies:
+            if cookie.get('sameSite') not in ('Strict', 'Lax', 'None'):
+                cookie.pop('sameSite', None)
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException:
+                continue
+        
+        driver.get(INVOICES_URL)
+        WebDriverWait(driver, 10, poll_frequency=0.1).until(EC.any_of(
+            EC.presence_of_element_located((By.TAG_NAME, "tbody")),
+            EC.presence_of_element_located((By.ID, "modlgn_username"))
+        ))
+        
+        if "login" not in driver.current_url.lower() and not driver.find_elements(By.ID, "modlgn_username"):
+            logger.info(f"Reused cached session for user: {username}")
+            return True
+    except (TimeoutException, WebDriverException) as e:
+        logger.info(f"Could not reuse cached session for {username}: {str(e)}")
+    
+    logger.info(f"Cached session for {username} has expired, logging in again")
+    discard_cookies(username)
+    driver.delete_all_cookies()
+    return False
+
+def store_session(driver, username, default_mandant=False):
+    try:
+        save_cookies(username, driver.get_cookies(), default_mandant)
+    except Exception as e:
+        logger.error(f"Could not cache session for {username}: {str(e)}")
+
 def switch_mandant(driver, mandant_text):
     if not mandant_text:
         return True
         
-    add_log("INFO", f"Attempting to switch to mandant: {mandant_text}")
+    logger.info(f"Attempting to switch to mandant: {mandant_text}")
     
     try:
-        time.sleep(2)
+        wait_for_ajax_idle(driver)
         
         dropdown_selectors = [
             "div.ui-selectonemenu-trigger",
@@ -161,9 +401,8 @@ def switch_mandant(driver, mandant_text):
                 for dropdown in dropdowns:
                     if dropdown.is_displayed():
                         dropdown.click()
-                        time.sleep(1)
                         dropdown_clicked = True
-                        add_log("INFO", f"Clicked dropdown using selector: {selector}")
+                        logger.info(f"Clicked dropdown using selector: {selector}")
                         break
                 if dropdown_clicked:
                     break
@@ -189,211 +428,815 @@ def switch_mandant(driver, mandant_text):
         
         if mandant_li:
             mandant_li.click()
-            add_log("INFO", f"Successfully switched to mandant: {mandant_text}")
-            time.sleep(2)
+            WebDriverWait(driver, 5, poll_frequency=0.1).until(EC.invisibility_of_element(mandant_li))
+            wait_for_ajax_idle(driver)
+            logger.info(f"Successfully switched to mandant: {mandant_text}")
             return True
         else:
-            add_log("ERROR", f"Could not find mandant option: {mandant_text}")
+            logger.error(f"Could not find mandant option: {mandant_text}")
             save_debug_screenshot(driver, "error_mandant_notfound")
             return False
         
     except TimeoutException:
-        add_log("ERROR", f"Could not find mandant: {mandant_text}")
+        logger.error(f"Could not find mandant: {mandant_text}")
         save_debug_screenshot(driver, "error_mandant_timeout")
         return False
     except Exception as e:
-        add_log("ERROR", f"Error switching mandant: {str(e)}")
+        logger.error(f"Error switching mandant: {str(e)}")
         save_debug_screenshot(driver, "error_mandant")
         return False
 
-def wait_for_download(existing_files, timeout=30):
-    end_time = time.time() + timeout
-    while time.time() < end_time:
-        current_files = set(glob.glob(os.path.join(DOWNLOAD_DIR, "*.pdf")))
-        new_files = current_files - existing_files
-        completed_new_files = [f for f in new_files if not f.endswith('.crdownload')]
-        if completed_new_files:
-            newest = max(completed_new_files, key=os.path.getctime)
-            return newest
-        time.sleep(1)
-    return None
+def wait_for_download(watcher, mark, timeout=DOWNLOAD_TIMEOUT):
+    with metrics.timer('mareon_download_wait_seconds'):
+        return watcher.wait(mark, timeout)
+
+def create_http_session(driver):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    
+    try:
+        session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent;")
+    except Exception:
+        pass
+    
+    sync_session_cookies(session, driver)
+    return session
+
+def sync_session_cookies(session, driver):
+    session.cookies.clear()
+    for cookie in driver.get_cookies():
+        session.cookies.set(
+            cookie['name'],
+            cookie['value'],
+            domain=cookie.get('domain'),
+            path=cookie.get('path', '/')
+        )
+
+def get_direct_download_url(page_url, href, onclick=None):
+    href = (href or '').strip()
+    
+    if not href or href.startswith('#') or href.lower().startswith('javascript:'):
+        return None
+    if onclick:
+        return None
+    
+    return urljoin(page_url, href)
+
+def parse_invoice_date(text):
+    try:
+        return datetime.strptime(text, "%d.%m.%Y").date()
+    except (TypeError, ValueError):
+        return None
+
+def extract_invoice_rows(driver):
+    invoices = []
+    
+    for row in driver.execute_script(INVOICE_ROWS_SCRIPT) or []:
+        text = row['text']
+        invoice_match = INVOICE_NR_PATTERN.search(text)
+        if not invoice_match:
+            continue
+        
+        date_match = INVOICE_DATE_PATTERN.search(text)
+        amount_match = INVOICE_AMOUNT_PATTERN.search(text)
+        invoices.append({
+            'index': row['index'],
+            'invoice_nr': invoice_match.group(),
+            'date': date_match.group() if date_match else None,
+            'amount': amount_match.group() if amount_match else None,
+            'href': row['href'],
+            'onclick': row['onclick'],
+            'link': row['link'],
+        })
+    
+    return invoices
+
+def download_via_http(session, url, download_dir, invoice_nr, referer=None, timeout=60):
+    headers = {'Referer': referer} if referer else {}
+    
+    try:
+        with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                logger.info(f"Direct download returned status {response.status_code} for invoice: {invoice_nr}")
+                return None
+            
+            chunks = response.iter_content(chunk_size=DIRECT_DOWNLOAD_CHUNK_SIZE)
+            first_chunk = next(chunks, b'')
+            if not first_chunk.startswith(b'%PDF'):
+                logger.info(f"Direct download did not return a PDF for invoice: {invoice_nr}")
+                return None
+            
+            # The server's file name may be generic (e.g. "Rechnung.pdf"); earlier downloads can still be
+            # waiting for delivery, so the invoice number keeps each file unique.
+            filepath = os.path.join(download_dir, f"{invoice_nr}.pdf")
+            partial_path = filepath + '.part'
+            
+            try:
+                with open(partial_path, 'wb') as f:
+                    f.write(first_chunk)
+                    for chunk in chunks:
+                        f.write(chunk)
+            except Exception:
+                # A connection dropped mid-body must not leave the partial file behind.
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                raise
+            
+            os.replace(partial_path, filepath)
+            return filepath
+            
+    except requests.exceptions.RequestException as e:
+        logger.info(f"Direct download failed for invoice {invoice_nr}: {str(e)}")
+        return None
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
 
 def cleanup_downloads():
-    for f in glob.glob(os.path.join(DOWNLOAD_DIR, "*.pdf")):
+    for f in glob.glob(os.path.join(PROCESS_DOWNLOAD_DIR, "**", "*.pdf"), recursive=True):
         try:
             os.remove(f)
         except Exception:
             pass
+    
+    # Folders left behind by processes on this host that are no longer running.
+    for path in glob.glob(os.path.join(DOWNLOAD_DIR, f"{glob.escape(PROCESS_DOWNLOAD_PREFIX)}*")):
+        pid = path.rsplit('-', 1)[-1]
+        if pid.isdigit() and path != PROCESS_DOWNLOAD_DIR and not process_alive(int(pid)):
+            shutil.rmtree(path, ignore_errors=True)
 
-def save_to_local_path(filepath, save_path, invoice_nr):
-    try:
-        os.makedirs(save_path, exist_ok=True)
-        
-        filename = os.path.basename(filepath)
-        base, ext = os.path.splitext(filename)
-        dest_filename = f"{invoice_nr}{ext}" if invoice_nr else filename
-        dest_path = os.path.join(save_path, dest_filename)
-        
-        counter = 1
-        while os.path.exists(dest_path):
-            dest_filename = f"{invoice_nr}_{counter}{ext}"
-            dest_path = os.path.join(save_path, dest_filename)
-            counter += 1
-        
-        import shutil
-        shutil.move(filepath, dest_path)
-        add_log("INFO", f"Saved invoice to: {dest_path}")
-        return True
-    except Exception as e:
-        add_log("ERROR", f"Failed to save invoice locally: {str(e)}")
+def download_invoice(driver, invoice, http_session, page_url, download_dir, watcher):
+    invoice_nr = invoice['invoice_nr']
+    direct_url = get_direct_download_url(page_url, invoice['href'], invoice['onclick'])
+    
+    if direct_url:
+        downloaded_file = download_via_http(
+            http_session, direct_url, download_dir, invoice_nr, referer=page_url
+        )
+        if downloaded_file:
+            return downloaded_file
+        logger.info(f"Falling back to browser download for invoice: {invoice_nr}")
+    
+    mark = watcher.mark()
+    
+    invoice['link'].click()
+    logger.info(f"Clicked download for invoice: {invoice_nr}")
+    
+    return wait_for_download(watcher, mark)
+
+def go_to_next_page(driver, invoices):
+    previous_first = invoices[0]['invoice_nr'] if invoices else None
+    
+    if not driver.execute_script(NEXT_PAGE_SCRIPT):
         return False
+    
+    WebDriverWait(driver, 10, poll_frequency=0.1).until(
+        lambda d: is_ajax_idle(d) and d.execute_script(FIRST_ROW_TEXT_SCRIPT) != previous_first
+    )
+    return True
 
-def process_invoices(driver, api_key, save_path):
-    add_log("INFO", "Navigating to invoices page")
+def process_invoices(driver, account_id, api_key, save_path, history, download_dir=DOWNLOAD_DIR, timings=None,
+                     high_water_mark=None, start_page=1, on_page=None, since=None, dry_run=False):
+    logger.info("Navigating to invoices page")
+    
+    processed_count = 0
+    skipped_count = 0
+    failed_count = 0
+    queued_count = 0
+    newest_invoice = None
+    pending_numbers = []
+    truncated = False
+    http_session = None
+    pipeline = None
+    watcher = None
+    
+    # An explicit start date replaces the high-water mark as the point to stop at.
+    high_water_key = invoice_number_key(high_water_mark) if high_water_mark and since is None else None
     
     try:
-        driver.get(INVOICES_URL)
-        time.sleep(3)
-        
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.TAG_NAME, "tbody"))
-        )
+        with timed(timings, 'load_invoices'):
+            driver.get(INVOICES_URL)
+            
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.TAG_NAME, "tbody"))
+            )
+            wait_for_ajax_idle(driver)
+            measure_page_load(driver, timings, 'invoices')
         
-        rows = driver.find_elements(By.CSS_SELECTOR, "tbody tr")
-        add_log("INFO", f"Found {len(rows)} invoice rows")
+        if not dry_run:
+            http_session = create_http_session(driver)
+            watcher = DownloadWatcher(download_dir).start()
+            pipeline = DeliveryPipeline(history, account_id, api_key, save_path, timings=timings)
+        page = 1
         
-        processed_count = 0
-        skipped_count = 0
+        # Pages before the checkpoint were handled before the run was interrupted.
+        while page < start_page:
+            with timed(timings, 'load_invoices'):
+                invoices = extract_invoice_rows(driver)
+                for invoice in invoices:
+                    key = invoice_number_key(invoice['invoice_nr'])
+                    if key is not None and (newest_invoice is None or key > newest_invoice['key']):
+                        newest_invoice = {'key': key, 'invoice_nr': invoice['invoice_nr'], 'date': invoice['date']}
+                if not go_to_next_page(driver, invoices):
+                    break
+            page += 1
+        if page > 1:
+            logger.info(f"Resuming at page {page}")
         
-        for i, row in enumerate(rows):
-            try:
-                row_text = row.text
-                
-                invoice_match = re.search(r'S-\d+', row_text)
-                if not invoice_match:
-                    continue
-                    
-                invoice_nr = invoice_match.group()
+        while True:
+            if on_page:
+                on_page(page)
+            with timed(timings, 'load_invoices'):
+                invoices = extract_invoice_rows(driver)
+                page_url = driver.current_url
+            logger.info(f"Found {len(invoices)} invoice rows on page {page}")
+            
+            pending_invoices = []
+            page_skipped = 0
+            reached_high_water_mark = False
+            reached_since = False
+            
+            for invoice in invoices:
+                key = invoice_number_key(invoice['invoice_nr'])
+                if key is not None:
+                    if newest_invoice is None or key > newest_invoice['key']:
+                        newest_invoice = {'key': key, 'invoice_nr': invoice['invoice_nr'], 'date': invoice['date']}
+                    if high_water_key is not None and key <= high_water_key:
+                        reached_high_water_mark = True
                 
-                if is_invoice_processed(invoice_nr):
-                    add_log("INFO", f"Skipping already processed invoice: {invoice_nr}")
-                    skipped_count += 1
-                    continue
+                if since is not None:
+                    invoice_date = parse_invoice_date(invoice['date'])
+                    if invoice_date is not None and invoice_date < since:
+                        reached_since = True
+                        continue
                 
-                add_log("INFO", f"Processing invoice: {invoice_nr}")
+                if invoice['invoice_nr'] in history:
+                    page_skipped += 1
+                else:
+                    pending_invoices.append(invoice)
+            
+            skipped_count += page_skipped
+            if page_skipped:
+                logger.info(f"Skipping {page_skipped} already processed invoice(s)")
+            
+            if dry_run:
+                for invoice in pending_invoices:
+                    logger.info(f"Would process invoice: {invoice['invoice_nr']}")
+                pending_numbers.extend(invoice['invoice_nr'] for invoice in pending_invoices)
+                pending_invoices = []
+            
+            for invoice in pending_invoices:
+                invoice_nr = invoice['invoice_nr']
                 
                 try:
-                    download_link = row.find_element(By.CSS_SELECTOR, 'a[title="Rechnungsdruck"]')
-                except NoSuchElementException:
-                    try:
-                        download_link = row.find_element(By.XPATH, './/a[contains(@title, "Rechnung")]')
-                    except NoSuchElementException:
-                        add_log("ERROR", f"No download link found for invoice: {invoice_nr}")
+                    if not history.claim(invoice_nr):
+                        logger.info(f"Invoice {invoice_nr} is handled by another instance, skipping")
+                        skipped_count += 1
                         continue
-                
-                existing_files = set(glob.glob(os.path.join(DOWNLOAD_DIR, "*.pdf")))
-                
-                download_link.click()
-                add_log("INFO", f"Clicked download for invoice: {invoice_nr}")
-                time.sleep(1)
-                
-                downloaded_file = wait_for_download(existing_files)
-                
-                if downloaded_file:
-                    add_log("INFO", f"Downloaded file: {downloaded_file}")
                     
-                    success = False
+                    logger.info(f"Processing invoice: {invoice_nr}")
                     
-                    if api_key:
-                        if upload_invoice(downloaded_file, api_key):
-                            success = True
-                            try:
-                                os.remove(downloaded_file)
-                                add_log("INFO", f"Deleted local file after upload: {downloaded_file}")
-                            except Exception as e:
-                                add_log("ERROR", f"Could not delete file: {str(e)}")
-                        else:
-                            add_log("ERROR", f"Upload failed for invoice: {invoice_nr}")
+                    if invoice['link'] is None:
+                        logger.error(f"No download link found for invoice: {invoice_nr}")
+                        failed_count += 1
+                        continue
                     
-                    elif save_path:
-                        if save_to_local_path(downloaded_file, save_path, invoice_nr):
-                            success = True
-                        else:
-                            add_log("ERROR", f"Save failed for invoice: {invoice_nr}")
+                    with timed(timings, 'download'):
+                        downloaded_file = download_invoice(
+                            driver, invoice, http_session, page_url, download_dir, watcher
+                        )
                     
-                    else:
-                        add_log("ERROR", f"No API key or save path configured for invoice: {invoice_nr}")
+                    if not downloaded_file:
+                        logger.error(f"Download timeout for invoice: {invoice_nr}")
+                        failed_count += 1
+                        continue
                     
-                    if success:
-                        add_to_history(invoice_nr)
-                        processed_count += 1
-                    else:
-                        try:
-                            if os.path.exists(downloaded_file):
-                                os.remove(downloaded_file)
-                                add_log("INFO", f"Cleaned up failed file: {downloaded_file}")
-                        except Exception:
-                            pass
-                else:
-                    add_log("ERROR", f"Download timeout for invoice: {invoice_nr}")
+                    logger.info(f"Downloaded file: {downloaded_file}")
                     
-            except Exception as e:
-                add_log("ERROR", f"Error processing row {i}: {str(e)}")
-                continue
+                    with timed(timings, 'delivery_wait'):
+                        pipeline.submit(downloaded_file, invoice_nr)
+                    
+                except Exception as e:
+                    logger.error(f"Error processing invoice {invoice_nr}: {str(e)}")
+                    failed_count += 1
+            
+            if reached_high_water_mark:
+                logger.info(f"Reached previously seen invoice {high_water_mark} on page {page}, stopping")
+                break
+            if reached_since:
+                logger.info(f"Reached invoices older than {since.isoformat()} on page {page}, stopping")
+                break
+            if page >= MAX_INVOICE_PAGES:
+                logger.info(f"Reached page limit ({MAX_INVOICE_PAGES}), stopping")
+                truncated = True
+                break
+            
+            with timed(timings, 'load_invoices'):
+                if not go_to_next_page(driver, invoices):
+                    break
+            page += 1
         
-        add_log("INFO", f"Completed: {processed_count} processed, {skipped_count} skipped")
-        return processed_count
+        error = None
         
     except TimeoutException:
-        add_log("ERROR", "Timeout loading invoices page")
+        logger.error("Timeout loading invoices page")
         save_debug_screenshot(driver, "error_invoices_timeout")
-        return 0
+        error = "Timeout loading invoices page"
     except Exception as e:
-        add_log("ERROR", f"Error processing invoices: {str(e)}")
+        logger.error(f"Error processing invoices: {str(e)}")
         save_debug_screenshot(driver, "error_invoices")
-        return 0
-
-def run_scraper():
-    add_log("INFO", "=== Starting Mareon Invoice Scraper ===")
+        error = str(e)
+    finally:
+        if pipeline:
+            with timed(timings, 'delivery_drain'):
+                delivered, undelivered, queued, duplicates = pipeline.close()
+            processed_count += delivered
+            skipped_count += duplicates
+            failed_count += undelivered
+            queued_count += queued
+        history.flush()
+        if http_session:
+            http_session.close()
+        if watcher:
+            watcher.close()
     
-    cleanup_downloads()
-    add_log("INFO", "Cleaned up any leftover download files")
+    if dry_run:
+        logger.info(f"Dry run completed: {len(pending_numbers)} invoice(s) would be processed, {skipped_count} skipped")
+    else:
+        logger.info(
+            f"Completed: {processed_count} processed, {skipped_count} skipped, "
+            f"{queued_count} queued for retry, {failed_count} failed"
+        )
+    return {
+        'processed': processed_count,
+        'skipped': skipped_count,
+        'queued': queued_count,
+        'failed': failed_count,
+        'error': error,
+        'newest_invoice': newest_invoice,
+        'pending': pending_numbers,
+        'truncated': truncated,
+    }
+
+def new_result(account, status='ok', error=None):
+    return {
+        'account': account['name'],
+        'account_id': account['id'],
+        'status': status,
+        'processed': 0,
+        'skipped': 0,
+        'queued': 0,
+        'failed': 0,
+        'error': error,
+        'timings': {},
+    }
+
+def group_accounts(accounts):
+    groups = {}
+    for account in accounts:
+        groups.setdefault((account['username'], account['password']), []).append(account)
+    # Accounts without a mandant use whatever the portal selects after login, so they go first.
+    return [sorted(group, key=lambda account: bool(account['mandant_dropdown'])) for group in groups.values()]
+
+def process_account_group(driver, accounts, history, download_dir=DOWNLOAD_DIR, run_id=None, since=None,
+                          dry_run=False):
+    username = accounts[0]['username']
+    if len(accounts) > 1:
+        logger.info(f"--- Processing {len(accounts)} accounts sharing the login {username} ---")
     
-    accounts = get_all_accounts()
+    login_timings = {}
+    logged_in = False
+    # Accounts without a mandant rely on the portal default, which a restored session
+    # no longer has once an earlier run switched mandants in it.
+    needs_default_mandant = any(not account['mandant_dropdown'] for account in accounts)
+    default_mandant = False
     
-    if not accounts:
-        add_log("ERROR", "No accounts configured. Please add an account first.")
-        return
+    try:
+        with log_context(account_id=accounts[0]['id']):
+            with timed(login_timings, 'login'):
+                logged_in = restore_session(driver, username, needs_default_mandant)
+                default_mandant = logged_in and needs_default_mandant
+                if not logged_in:
+                    logged_in = login(driver, username, accounts[0]['password'], login_timings)
+                    default_mandant = True
+                    if logged_in:
+                        store_session(driver, username, default_mandant)
+        
+        for account in accounts:
+            with log_context(account_id=account['id']):
+                if not logged_in:
+                    logger.error(f"Skipping account due to login failure: {account['name']}")
+                    yield new_result(account, 'login_failed')
+                    continue
+                
+                if account['mandant_dropdown']:
+                    default_mandant = False
+                result = process_account(driver, account, history, download_dir, run_id, since, dry_run)
+                # The shared login is only paid once; it is attributed to the first account.
+                for step, seconds in login_timings.items():
+                    result['timings'][step] = result['timings'].get(step, 0.0) + seconds
+                login_timings = {}
+                yield result
+    finally:
+        if logged_in:
+            store_session(driver, username, default_mandant)
+        try:
+            driver.delete_all_cookies()
+        except WebDriverException:
+            pass
+
+def process_account(driver, account, history, download_dir=DOWNLOAD_DIR, run_id=None, since=None, dry_run=False):
+    account_name = account['name']
+    logger.info(f"--- Processing account: {account_name} ---")
     
-    add_log("INFO", f"Found {len(accounts)} account(s) to process")
+    result = new_result(account)
+    timings = result['timings']
+    # Workers and pooled drivers reuse one browser for many accounts.
+    reset_driver_peak_rss(driver)
     
-    driver = None
+    try:
+        if account['mandant_dropdown']:
+            with timed(timings, 'switch_mandant'):
+                switched = switch_mandant(driver, account['mandant_dropdown'])
+            if not switched:
+                result['status'] = 'mandant_failed'
+                result['error'] = f"Could not switch to mandant {account['mandant_dropdown']}"
+                return result
+        
+        api_key = account['butler_api_key'] if 'butler_api_key' in account.keys() else None
+        save_path = account['save_path'] if 'save_path' in account.keys() else None
+        state = get_high_water_mark(account['id'])
+        high_water_mark = state['last_invoice_nr'] if state else None
+        
+        start_page = 1
+        on_page = None
+        if run_id:
+            checkpoint = get_run_account(run_id, account['id'])
+            start_page = checkpoint['page'] if checkpoint else 1
+            on_page = lambda page: set_run_account_page(run_id, account['id'], page)
+        
+        with timed(timings, 'process_invoices'):
+            counts = process_invoices(
+                driver, account['id'], api_key, save_path, history, download_dir, timings, high_water_mark,
+                start_page, on_page, since, dry_run
+            )
+        newest_invoice = counts.pop('newest_invoice')
+        pending = counts.pop('pending')
+        truncated = counts.pop('truncated')
+        result.update(counts)
+        if dry_run:
+            result['pending'] = pending
+        
+        rss_mb = driver_peak_rss_mb(driver)
+        if rss_mb is not None:
+            result['peak_rss_mb'] = round(rss_mb, 1)
+        
+        if counts['error']:
+            result['status'] = 'error'
+        elif truncated:
+            # Pages beyond the limit were never visited; moving the mark would skip them for good.
+            logger.info("Keeping the high-water mark because the page limit cut the run short")
+        elif start_page > 1:
+            # Failures on the pages before the crash are not known here; keep the mark so they are retried.
+            logger.info(f"Keeping the high-water mark because the account was resumed at page {start_page}")
+        elif counts['failed'] == 0 and newest_invoice and not dry_run:
+            if high_water_mark is None or newest_invoice['key'] > invoice_number_key(high_water_mark):
+                set_high_water_mark(account['id'], newest_invoice['invoice_nr'], newest_invoice['date'])
+                logger.info(f"Updated high-water mark to {newest_invoice['invoice_nr']}")
+    except Exception as e:
+        logger.error(f"Error processing account {account_name}: {str(e)}")
+        result['status'] = 'error'
+        result['error'] = str(e)
     
+    return result
+
+def driver_alive(driver):
     try:
-        driver = setup_driver()
-        add_log("INFO", "WebDriver initialized successfully")
+        driver.execute_script("return 1;")
+        return True
+    except WebDriverException:
+        return False
+
+def record_result(result, results, results_lock, run_id=None):
+    with results_lock:
+        results.append(result)
+    if run_id:
+        try:
+            finish_run_account(
+                run_id, result['account_id'], result['status'], result['processed'], result['skipped'],
+                result['queued'], result['failed'], result['error']
+            )
+            # Recorded per account so other instances can tell it was done during their run.
+            if result['status'] not in ('not_processed', 'leased'):
+                set_account_last_run(
+                    [result['account_id']], datetime.now().strftime("%Y-%m-%d %H:%M:%S"), INSTANCE_ID
+                )
+        except Exception as e:
+            logger.error(f"Could not checkpoint account {result['account']}: {str(e)}")
+
+def claim_group(accounts, leases, started_at, results, results_lock, run_id=None):
+    claimed = leases.claim(accounts)
+    claimed_ids = {account['id'] for account in claimed}
+    done_elsewhere = []
+    pending = []
+    
+    for account in accounts:
+        if account['id'] not in claimed_ids:
+            logger.info(f"Account {account['name']} is being processed by another instance, skipping")
+            record_result(new_result(account, 'leased'), results, results_lock, run_id)
+            continue
+        # last_run_at only has one-second resolution, so an account this instance finished
+        # in the second a queued run started would look done; only other owners count.
+        current = get_account(account['id'])
+        last_run_at = current['last_run_at'] if current else None
+        finished_elsewhere = current and current['last_run_owner'] not in (None, INSTANCE_ID)
+        if finished_elsewhere and started_at and last_run_at and last_run_at >= started_at:
+            logger.info(f"Account {account['name']} was processed by another instance during this run, skipping")
+            record_result(new_result(account, 'leased'), results, results_lock, run_id)
+            done_elsewhere.append(account)
+            continue
+        pending.append(account)
+    
+    leases.release(done_elsewhere)
+    return pending
+
+def scraper_worker(worker_id, group_queue, history, results, results_lock, run_id=None, driver_pool=None,
+                   since=None, dry_run=False, leases=None, started_at=None):
+    with log_context(run_id=run_id):
+        download_dir = os.path.join(PROCESS_DOWNLOAD_DIR, f"worker_{worker_id}")
+        driver = None
+        pooled = None
+        healthy = True
         
-        for account in accounts:
-            account_name = account['name']
-            add_log("INFO", f"--- Processing account: {account_name} ---")
+        try:
+            if driver_pool:
+                pooled = driver_pool.acquire(timeout=DRIVER_POOL_ACQUIRE_TIMEOUT)
+                driver = pooled.driver
+                download_dir = pooled.download_dir
+                logger.info(f"Using pooled WebDriver {pooled.slot} (worker {worker_id})")
+            else:
+                driver = setup_driver(download_dir)
+                logger.info(f"WebDriver initialized successfully (worker {worker_id})")
             
-            if login(driver, account['username'], account['password']):
-                if account['mandant_dropdown']:
-                    switch_mandant(driver, account['mandant_dropdown'])
+            while True:
+                try:
+                    accounts, restarts = group_queue.get_nowait()
+                except queue.Empty:
+                    break
+                
+                if leases:
+                    accounts = claim_group(accounts, leases, started_at, results, results_lock, run_id)
+                    if not accounts:
+                        continue
                 
-                api_key = account['butler_api_key'] if 'butler_api_key' in account.keys() else None
-                save_path = account['save_path'] if 'save_path' in account.keys() else None
-                process_invoices(driver, api_key, save_path)
+                done = set()
+                crashed = False
+                group_results = process_account_group(
+                    driver, accounts, history, download_dir, run_id, since, dry_run
+                )
+                try:
+                    for result in group_results:
+                        if (result['status'] != 'ok' and restarts < MAX_DRIVER_RESTARTS
+                                and not driver_alive(driver)):
+                            crashed = True
+                            break
+                        done.add(result['account_id'])
+                        record_result(result, results, results_lock, run_id)
+                except Exception as e:
+                    if restarts < MAX_DRIVER_RESTARTS and not driver_alive(driver):
+                        crashed = True
+                    else:
+                        logger.error(f"Error processing login {accounts[0]['username']}: {str(e)}")
+                        for account in accounts:
+                            if account['id'] not in done:
+                                record_result(new_result(account, 'error', str(e)), results, results_lock, run_id)
+                finally:
+                    group_results.close()
+                    # Requeued accounts keep their lease; the same owner can claim it again.
+                    if leases:
+                        leases.release(accounts if not crashed else [
+                            account for account in accounts if account['id'] in done
+                        ])
+                
+                if crashed:
+                    remaining = [account for account in accounts if account['id'] not in done]
+                    logger.error(
+                        f"WebDriver crashed (worker {worker_id}), restarting it and resuming "
+                        f"{len(remaining)} account(s) from their checkpoint"
+                    )
+                    group_queue.put((remaining, restarts + 1))
+                    metrics.inc('mareon_driver_restarts_total')
+                    if pooled:
+                        driver_pool.release(pooled, healthy=False)
+                        pooled = driver = None
+                        pooled = driver_pool.acquire(timeout=DRIVER_POOL_ACQUIRE_TIMEOUT)
+                        driver = pooled.driver
+                        download_dir = pooled.download_dir
+                    else:
+                        try:
+                            driver.quit()
+                        except Exception:
+                            pass
+                        driver = None
+                        driver = setup_driver(download_dir)
+                    logger.info(f"WebDriver restarted (worker {worker_id})")
+        
+        except Exception as e:
+            logger.error(f"Scraper error (worker {worker_id}): {str(e)}")
+            healthy = False
+        finally:
+            if pooled:
+                driver_pool.release(pooled, healthy)
+            elif driver:
+                driver.quit()
+                logger.info(f"WebDriver closed (worker {worker_id})")
+
+def run_scraper(max_workers=None, run_id=None, driver_pool=None, account_ids=None, trigger='manual', since=None,
+                dry_run=False):
+    run_id = run_id or uuid.uuid4().hex[:12]
+    existing_run = get_run(run_id)
+    
+    with log_context(run_id=run_id):
+        if existing_run and existing_run['status'] != 'running':
+            logger.error(f"Run {run_id} already finished ({existing_run['status']}), not resuming it")
+            return []
+        if existing_run and not take_over_run(run_id, INSTANCE_ID, ACCOUNT_LEASE_TTL_SECONDS):
+            logger.info(f"Run {run_id} is still being executed by instance {existing_run['owner']}, not resuming it")
+            return []
+        if existing_run:
+            logger.info(f"=== Resuming interrupted Mareon Invoice Scraper run {run_id} ===")
+        else:
+            logger.info(f"=== Starting Mareon Invoice Scraper (run {run_id}, {trigger}) ===")
+        if dry_run:
+            logger.info("Dry run: nothing is downloaded, delivered or recorded")
+        
+        if not dry_run:
+            cleanup_downloads()
+            logger.info("Cleaned up any leftover download files")
+        
+        if not dry_run:
+            drain_outbox()
+        
+        accounts = get_all_accounts()
+        checkpoints = {}
+        if existing_run:
+            checkpoints = {row['account_id']: row for row in get_run_accounts(run_id)}
+            accounts = [account for account in accounts if account['id'] in checkpoints]
+        elif account_ids is not None:
+            accounts = [account for account in accounts if account['id'] in account_ids]
+        
+        if not accounts:
+            if existing_run:
+                logger.error("None of the accounts of the interrupted run exist anymore.")
+                finish_run(run_id, 'failed', 0, 0, 0, 0)
+            elif account_ids is None:
+                logger.error("No accounts configured. Please add an account first.")
             else:
-                add_log("ERROR", f"Skipping account due to login failure: {account_name}")
-            
-            driver.delete_all_cookies()
-            
+                logger.error("None of the requested accounts exist anymore.")
+            return []
+        
+        leases = None if dry_run else AccountLeases(run_id=run_id)
+        results = []
+        if existing_run:
+            for account in accounts:
+                checkpoint = checkpoints[account['id']]
+                if checkpoint['status'] not in ('pending', 'running'):
+                    result = new_result(account, checkpoint['status'], checkpoint['error'])
+                    for key in ('processed', 'skipped', 'queued', 'failed'):
+                        result[key] = checkpoint[key]
+                    results.append(result)
+            finished_ids = {result['account_id'] for result in results}
+            logger.info(f"{len(finished_ids)} of {len(accounts)} account(s) were already finished")
+            pending_accounts = [account for account in accounts if account['id'] not in finished_ids]
+            started_at = existing_run['started_at']
+            if leases:
+                leases.start()
+        elif dry_run:
+            pending_accounts = accounts
+            started_at = None
+        else:
+            # Leases are taken per login group by the workers; accounts another instance
+            # is working on right now are left out of the run up front.
+            leased_ids = leases.held_elsewhere()
+            for account in accounts:
+                if account['id'] in leased_ids:
+                    logger.info(f"Account {account['name']} is being processed by another instance, skipping")
+            accounts = [account for account in accounts if account['id'] not in leased_ids]
+            if not accounts:
+                logger.info("=== Nothing to do, all accounts are being processed by other instances ===")
+                return []
+            started_at = start_run(run_id, trigger, len(accounts), INSTANCE_ID)
+            leases.start()
+            add_run_accounts(run_id, [account['id'] for account in accounts])
+            pending_accounts = accounts
+        
+        started = time.perf_counter()
+        try:
+            if pending_accounts:
+                # A dry run is not checkpointed, so the workers get no run id.
+                _run_accounts(
+                    pending_accounts, results, None if dry_run else run_id, max_workers, driver_pool, since, dry_run,
+                    leases, started_at
+                )
+        finally:
+            totals = {
+                key: sum(result[key] for result in results)
+                for key in ('processed', 'skipped', 'queued', 'failed')
+            }
+            if len(results) < len(accounts):
+                status = 'failed'
+            elif all(result['status'] in ('ok', 'leased') for result in results):
+                status = 'completed'
+            else:
+                status = 'completed_with_errors'
+            if not dry_run:
+                finish_run(run_id, status, **totals)
+                record_run_metrics(run_id, status, results, time.perf_counter() - started)
+                leases.release()
+                release_invoice_claims(INSTANCE_ID)
+        
+        logger.info(f"=== Scraper run completed ({status}) ===")
+        return results
+
+def record_run_metrics(run_id, status, results, duration):
+    metrics.inc('mareon_runs_total', status=status)
+    metrics.observe('mareon_run_duration_seconds', duration)
+    
+    entries = [(None, 'run_duration', duration)]
+    for result in results:
+        account_id = result['account_id']
+        for key in ('processed', 'skipped', 'queued', 'failed'):
+            if result[key]:
+                metrics.inc('mareon_invoices_total', result[key], account_id=account_id, result=key)
+            entries.append((account_id, key, result[key]))
+        for step, seconds in result['timings'].items():
+            entries.append((account_id, f"{step}_seconds", seconds))
+        if result.get('peak_rss_mb') is not None:
+            metrics.set_gauge('mareon_driver_peak_rss_bytes', result['peak_rss_mb'] * 1024 * 1024, account_id=account_id)
+            entries.append((account_id, 'peak_rss_mb', result['peak_rss_mb']))
+    
+    try:
+        add_run_metrics(run_id, entries)
     except Exception as e:
-        add_log("ERROR", f"Scraper error: {str(e)}")
-    finally:
-        if driver:
-            driver.quit()
-            add_log("INFO", "WebDriver closed")
+        logger.error(f"Could not store metrics for run {run_id}: {str(e)}")
+
+def _run_accounts(accounts, results, run_id, max_workers, driver_pool, since=None, dry_run=False, leases=None,
+                  started_at=None):
+    history = HistoryIndex.load()
+    logger.info(f"Loaded {len(history)} processed invoice(s) from history")
+    
+    groups = group_accounts(accounts)
+    worker_count = max(1, min(max_workers or MAX_WORKERS, len(groups)))
+    if driver_pool:
+        worker_count = min(worker_count, driver_pool.size)
+    logger.info(
+        f"Found {len(accounts)} account(s) under {len(groups)} login(s) to process with {worker_count} worker(s)"
+    )
+    
+    group_queue = queue.Queue()
+    for group in groups:
+        group_queue.put((group, 0))
     
-    add_log("INFO", "=== Scraper run completed ===")
+    results_lock = threading.Lock()
+    
+    workers = [
+        threading.Thread(
+            target=scraper_worker,
+            args=(
+                worker_id, group_queue, history, results, results_lock, run_id, driver_pool, since, dry_run, leases,
+                started_at
+            ),
+            name=f"scraper-worker-{worker_id}",
+            daemon=True,
+        )
+        for worker_id in range(1, worker_count + 1)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    
+    while not group_queue.empty():
+        for account in group_queue.get_nowait()[0]:
+            logger.error(f"Account not processed (no WebDriver available): {account['name']}")
+            results.append(new_result(account, 'not_processed', "No WebDriver available"))
+    
+    for result in results:
+        logger.log(
+            logging.INFO if result['status'] == 'ok' else logging.ERROR,
+            f"Result for {result['account']}: {result['status']} - "
+            f"{result['processed']} processed, {result['skipped']} skipped, "
+            f"{result['queued']} queued for retry, {result['failed']} failed"
+        )
+        if result['timings']:
+            logger.info(f"Timings for {result['account']}: {format_timings(result['timings'])}")
+        if result.get('peak_rss_mb') is not None:
+            logger.info(f"Peak browser memory for {result['account']}: {result['peak_rss_mb']} MB")
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSION_CACHE_DIR = os.path.abspath(os.path.join("data", "sessions"))
+SESSION_KEY_FILE = os.path.join(SESSION_CACHE_DIR, "session.key")
+SESSION_CACHE_ENABLED = os.environ.get("SESSION_CACHE", "1") != "0"
+SESSION_MAX_AGE_SECONDS = int(os.environ.get("SESSION_MAX_AGE_SECONDS", str(12 * 60 * 60)))
+
+_fernet = None
+
+
+def _get_fernet():
+    global _fernet
+    if _fernet is not None:
+        return _fernet
+
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        logger.error("cryptography is not installed, session cache disabled")
+        return None
+
+    key = os.environ.get("SESSION_CACHE_KEY")
+    if not key:
+        os.makedirs(SESSION_CACHE_DIR, exist_ok=True)
+        try:
+            fd = os.open(SESSION_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(Fernet.generate_key())
+        except FileExistsError:
+            pass
+        with open(SESSION_KEY_FILE, 'rb') as f:
+            key = f.read().strip()
+
+    _fernet = Fernet(key)
+    return _fernet
+
+
+def _session_path(username):
+    digest = hashlib.sha256(username.encode('utf-8')).hexdigest()[:32]
+    return os.path.join(SESSION_CACHE_DIR, f"{digest}.session")
+
+
+# Besides the cookies, a session records whether the portal still has its default
+# mandant selected; the selection lives on the server and survives a restore.
+# Sessions cached before this was recorded count as switched.
+def load_cookies(username):
+    if not SESSION_CACHE_ENABLED:
+        return None
+
+    path = _session_path(username)
+    if not os.path.exists(path):
+        return None
+
+    fernet = _get_fernet()
+    if fernet is None:
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            payload = json.loads(fernet.decrypt(f.read(), ttl=SESSION_MAX_AGE_SECONDS))
+    except Exception:
+        logger.info(f"Cached session for {username} is expired or unreadable")
+        discard_cookies(username)
+        return None
+
+    now = time.time()
+    cookies = [cookie for cookie in payload['cookies'] if cookie.get('expiry') is None or cookie['expiry'] > now]
+    return cookies, payload.get('default_mandant', False)
+
+
+def save_cookies(username, cookies, default_mandant=False):
+    if not SESSION_CACHE_ENABLED or not cookies:
+        return
+
+    fernet = _get_fernet()
+    if fernet is None:
+        return
+
+    os.makedirs(SESSION_CACHE_DIR, exist_ok=True)
+    path = _session_path(username)
+    partial_path = path + ".tmp"
+    token = fernet.encrypt(json.dumps({'cookies': cookies, 'default_mandant': default_mandant}).encode('utf-8'))
+
+    fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(token)
+    os.replace(partial_path, path)
+
+
+def discard_cookies(username):
+    try:
+        os.remove(_session_path(username))
+    except OSError:
+        pass
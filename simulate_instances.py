@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import multiprocessing
+
+LEASE_TTL_SECONDS = 2
+INVOICE_NUMBER_BASE = 9000000000
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Run several scraper instances against one throwaway database and check they split the work"
+    )
+    parser.add_argument("--instances", type=int, default=4, help="concurrent instances")
+    parser.add_argument("--accounts", type=int, default=20, help="accounts (one login each)")
+    parser.add_argument("--invoices", type=int, default=200, help="invoices spread over the accounts")
+    parser.add_argument("--workers", type=int, default=2, help="scraper workers per instance")
+    parser.add_argument("--verbose", action="store_true", help="show the log messages of the instances")
+    return parser.parse_args(argv)
+
+
+def account_invoices(account_ids, invoice_count):
+    invoices = {account_id: [] for account_id in account_ids}
+    for i in range(invoice_count):
+        invoices[account_ids[i % len(account_ids)]].append(f"S-{INVOICE_NUMBER_BASE + i}")
+    return invoices
+
+
+# Runs in a fresh process: the application modules read the instance id, lease
+# times and paths at import time, so they are only imported once those are set.
+def start_instance(owner, workdir, verbose):
+    os.environ["INSTANCE_ID"] = owner
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "app.db")
+    os.environ["ACCOUNT_LEASE_TTL_SECONDS"] = str(LEASE_TTL_SECONDS)
+    os.environ["INVOICE_CLAIM_TTL_SECONDS"] = str(LEASE_TTL_SECONDS)
+    os.environ["SESSION_CACHE"] = "0"
+    os.chdir(workdir)
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.CRITICAL,
+        format=f"[%(asctime)s] [{owner}] [%(levelname)s] %(message)s"
+    )
+
+    import scraper
+    from database import get_all_accounts
+
+    invoices = account_invoices([account['id'] for account in get_all_accounts()], int(os.environ["SIM_INVOICES"]))
+    claimed = []
+
+    # Stands in for the browser work: claims the account's invoices the way
+    # process_invoices does and records them in the history.
+    def process_account_group(driver, accounts, history, download_dir=None, run_id=None, since=None, dry_run=False):
+        for account in accounts:
+            result = scraper.new_result(account, 'ok')
+            for invoice_nr in invoices[account['id']]:
+                if invoice_nr in history or not history.claim(invoice_nr):
+                    result['skipped'] += 1
+                    continue
+                if owner == "sim-crashed":
+                    os._exit(0)
+                claimed.append(invoice_nr)
+                history.add(invoice_nr)
+                result['processed'] += 1
+            time.sleep(random.uniform(0.01, 0.05))
+            history.flush()
+            yield result
+
+    class Driver:
+        def quit(self):
+            pass
+
+        def execute_script(self, script):
+            return 1
+
+    scraper.process_account_group = process_account_group
+    scraper.setup_driver = lambda download_dir: Driver()
+    return scraper, claimed
+
+
+# An instance killed in the middle of an account: its run stays 'running' and its
+# account lease and invoice claim stay behind until they expire.
+def crashed_instance(workdir, verbose):
+    scraper, _ = start_instance("sim-crashed", workdir, verbose)
+    scraper.run_scraper(max_workers=1, trigger='simulation')
+
+
+def instance(number, workdir, verbose, workers, barrier, outcomes):
+    owner = f"sim-{number}"
+    scraper, claimed = start_instance(owner, workdir, verbose)
+    barrier.wait()
+    results = scraper.run_scraper(max_workers=workers, trigger='simulation')
+    processed = [result['account_id'] for result in results if result['status'] == 'ok']
+    outcomes.put((owner, processed, claimed))
+
+
+# Picks up the crashed instance's run the way the scheduler does. Every account
+# in it was finished by another instance since, so nothing is processed again.
+def resuming_instance(workdir, verbose, outcomes):
+    owner = "sim-resume"
+    scraper, claimed = start_instance(owner, workdir, verbose)
+    from database import get_interrupted_runs
+    processed = []
+    for run in get_interrupted_runs(owner, LEASE_TTL_SECONDS):
+        results = scraper.run_scraper(run_id=run['run_id'])
+        processed.extend(result['account_id'] for result in results if result['status'] == 'ok')
+    outcomes.put((owner, processed, claimed))
+
+
+def run_process(context, target, *args):
+    process = context.Process(target=target, args=args)
+    process.start()
+    return process
+
+
+def simulate(args):
+    workdir = tempfile.mkdtemp(prefix="mareon-instances-")
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "app.db")
+    os.environ["SIM_INVOICES"] = str(args.invoices)
+    context = multiprocessing.get_context("spawn")
+
+    import database
+    database.DB_PATH = os.environ["DATABASE_PATH"]
+    try:
+        database.init_db()
+        for i in range(args.accounts):
+            database.add_account(f"Sim {i + 1}", None, f"sim{i + 1}", "sim", None, workdir)
+        account_ids = [account['id'] for account in database.get_all_accounts()]
+        invoices = account_invoices(account_ids, args.invoices)
+        database.close_connection()
+
+        run_process(context, crashed_instance, workdir, args.verbose).join()
+        time.sleep(LEASE_TTL_SECONDS + 0.5)
+
+        outcomes = context.Queue()
+        barrier = context.Barrier(args.instances)
+        processes = [
+            run_process(context, instance, number, workdir, args.verbose, args.workers, barrier, outcomes)
+            for number in range(1, args.instances + 1)
+        ]
+        results = [outcomes.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        time.sleep(LEASE_TTL_SECONDS + 0.5)
+        run_process(context, resuming_instance, workdir, args.verbose, outcomes).join()
+        _, resumed, _ = outcomes.get()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    all_accounts = [account_id for _, processed, _ in results for account_id in processed]
+    all_invoices = [invoice_nr for _, _, claimed in results for invoice_nr in claimed]
+    for owner, processed, claimed in sorted(results):
+        print(f"{owner}: {len(processed)} account(s), {len(claimed)} invoice(s)")
+    duplicates = (len(all_accounts) - len(set(all_accounts))) + (len(all_invoices) - len(set(all_invoices)))
+    missing = (len(account_ids) - len(set(all_accounts))) + (args.invoices - len(set(all_invoices)))
+    taken_over = account_ids[0] in all_accounts and set(invoices[account_ids[0]]) <= set(all_invoices)
+    print(f"Crashed instance's account taken over: {'yes' if taken_over else 'no'}")
+    print(f"Crashed run resumed, accounts processed again: {len(resumed)}")
+    print(f"Duplicates: {duplicates}, unprocessed: {missing}")
+    return duplicates == 0 and missing == 0 and taken_over and not resumed
+
+
+if __name__ == '__main__':
+    sys.exit(0 if simulate(parse_args(sys.argv[1:])) else 1)